@@ -0,0 +1,316 @@
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import sys
+import time
+from itertools import product
+
+import numpy as np
+from vi.config import Window
+
+from lisaflock_v3 import Bird, Flocking, FlockingConfig
+
+
+# Headless throughput benchmark of the flocking model.
+# Every case (engine, proximity backend, bird count, radius, obstacle count) runs in
+# its own fresh process so peak RSS belongs to that case alone, results go to a JSON file
+# and are compared against a baseline stored on the same machine (fps don't carry over between machines).
+# Any regression makes the script exit with 1, without a baseline it only warns that nothing was compared.
+#
+#   python benchmark.py --quick                    # small matrix, a few seconds per case
+#   python benchmark.py --save-baseline            # store the current numbers as the baseline
+#   python benchmark.py --counts 50 5000 50000     # compare a custom matrix against the baseline
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+IMAGES = [os.path.join(HERE, "images", name) for name in ("bird.png", "red-bird.png", "green-bird.png")]
+OBSTACLE_IMAGE = os.path.join(HERE, "images", "triangle@50px.png")
+
+# (engine, proximity_backend) combinations, the per-agent path first
+ENGINES = [
+    ("agents", "violet"),
+    ("agents", "grid"),
+    ("agents", "kdtree"),
+    ("numpy", "violet"),
+    ("numpy", "grid"),
+    ("numpy", "kdtree"),
+]
+
+# Phases of HeadlessSimulation.tick, in order, "other" is the rest of the tick (radius, duration check, counter)
+PHASES = ["before_update", "change_position", "proximity", "replay", "update", "merge", "after_update", "other"]
+
+# The assignment runs 50 birds in a 750x750 window, bigger flocks get a bigger window with the same density
+DENSITY = 50 / 750 ** 2
+
+
+class TimedFlocking(Flocking):
+    # The headless model with a stopwatch around every phase of violet's own tick
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.reset()
+
+        # tick() looks these up on the instance (the private ones under their mangled names),
+        # so a timed wrapper in front of each one times that phase of the real tick
+        for phase, owner, name in (
+            # Includes the whole FlockEngine step for the numpy engine
+            ("before_update", self, "before_update"),
+            ("change_position", self, "_HeadlessSimulation__update_positions"),
+            ("proximity", self._proximity, "update"),
+            ("replay", self, "_HeadlessSimulation__collect_replay_data"),
+            ("update", self._all, "update"),
+            ("merge", self._metrics, "_merge"),
+            ("after_update", self, "after_update"),
+        ):
+            setattr(owner, name, self.timed(phase, getattr(owner, name)))
+
+    def timed(self, phase, method):
+        def run_timed(*args, **kwargs):
+            start = time.perf_counter()
+            result = method(*args, **kwargs)
+            self.phases[phase] += time.perf_counter() - start
+            return result
+        return run_timed
+
+    def tick(self):
+        start = time.perf_counter()
+        super().tick()
+        self.ticks += time.perf_counter() - start
+        self.phases["other"] = self.ticks - sum(seconds for phase, seconds in self.phases.items() if phase != "other")
+
+        counts = self.neighbour_counts()
+        self.neighbours_mean.append(round(float(counts.mean()), 3) if len(counts) else 0.0)
+        self.neighbours_max.append(int(counts.max(initial=0)))
+
+    def neighbour_counts(self):
+        if self.flock is not None:
+            return self.flock.neighbour_count
+        return np.array([len(bird._neighbours) for bird in self._agents], dtype=np.int64)
+
+    def reset(self):
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.ticks = 0.0
+        self.neighbours_mean = []
+        self.neighbours_max = []
+
+
+def window_for(birds):
+    side = max(750, round(math.sqrt(birds / DENSITY)))
+    return Window(side, side)
+
+
+def case_key(case):
+    return f"{case['engine']}/{case['backend']}/n={case['birds']}/r={case['radius']}/o={case['obstacles']}"
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+def run_case(case):
+    config = FlockingConfig(
+        image_rotation=True,
+        movement_speed=5,
+        radius=case["radius"],
+        seed=case["seed"],
+        window=window_for(case["birds"]),
+        engine=case["engine"],
+        proximity_backend=case["backend"],
+    )
+
+    simulation = TimedFlocking(config)
+    width, height = config.window.as_tuple()
+
+    # Obstacles first so the birds don't spawn inside them, both engines avoid them through the distance field
+    for _ in range(case["obstacles"]):
+        simulation.spawn_obstacle(OBSTACLE_IMAGE, x=random.randint(0, width), y=random.randint(0, height))
+
+    start = time.perf_counter()
+    simulation.batch_spawn_agents(case["birds"], Bird, images=IMAGES)
+    spawn = time.perf_counter() - start
+
+    # Warm-up frames build the engine and the indexes, they are not part of the timing
+    for _ in range(case["warmup"]):
+        simulation.tick()
+    simulation.reset()
+
+    start = time.perf_counter()
+    for _ in range(case["frames"]):
+        simulation.tick()
+    elapsed = time.perf_counter() - start
+
+    return {
+        **case,
+        "key": case_key(case),
+        "window": [width, height],
+        "spawn_seconds": round(spawn, 4),
+        "seconds": round(elapsed, 4),
+        "fps": round(case["frames"] / elapsed, 3),
+        # Milliseconds per frame spent in every phase
+        "phases_ms": {phase: round(1000 * total / case["frames"], 4) for phase, total in simulation.phases.items()},
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "neighbours_mean": simulation.neighbours_mean,
+        "neighbours_max": simulation.neighbours_max,
+    }
+
+
+def build_cases(args):
+    cases = []
+    for (engine, backend), birds, radius, obstacles in product(ENGINES, args.counts, args.radii, args.obstacles):
+        if engine not in args.engines:
+            continue
+        # The per-agent path needs minutes per frame for the biggest flocks
+        if engine == "agents" and birds > args.max_agents_birds:
+            continue
+        cases.append({
+            "engine": engine,
+            "backend": backend,
+            "birds": birds,
+            "radius": radius,
+            "obstacles": obstacles,
+            "seed": args.seed,
+            "frames": args.frames,
+            "warmup": args.warmup,
+        })
+    return cases
+
+
+def scaling_curves(results):
+    # fps against bird count per (engine, backend, radius, obstacles), with the slope of
+    # log(seconds per frame) over log(birds): 1 is linear scaling, 2 is quadratic
+    groups = {}
+    for result in results:
+        group = f"{result['engine']}/{result['backend']}/r={result['radius']}/o={result['obstacles']}"
+        groups.setdefault(group, []).append(result)
+
+    curves = {}
+    for group, members in groups.items():
+        members.sort(key=lambda result: result["birds"])
+        birds = [result["birds"] for result in members]
+        fps = [result["fps"] for result in members]
+
+        exponent = None
+        if len(members) > 1:
+            exponent = round(float(np.polyfit(np.log(birds), np.log(1 / np.array(fps)), 1)[0]), 3)
+
+        curves[group] = {"birds": birds, "fps": fps, "exponent": exponent}
+    return curves
+
+
+def compare(results, baseline, fps_tolerance, rss_tolerance):
+    # Returns the list of regressions, every case is printed next to its baseline
+    previous = {result["key"]: result for result in baseline["cases"]}
+    regressions = []
+
+    print(f"\n{'case':<44} {'fps':>10} {'baseline':>10} {'change':>8} {'rss MB':>8} {'baseline':>9}")
+    for result in results:
+        old = previous.get(result["key"])
+        if old is None:
+            print(f"{result['key']:<44} {result['fps']:>10.2f} {'-':>10} {'new':>8} {result['peak_rss_mb']:>8.1f} {'-':>9}")
+            continue
+
+        change = result["fps"] / old["fps"] - 1
+        flags = []
+        if result["fps"] < old["fps"] * (1 - fps_tolerance):
+            flags.append("SLOWER")
+        if result["peak_rss_mb"] > old["peak_rss_mb"] * (1 + rss_tolerance):
+            flags.append("MEMORY")
+
+        # A different neighbour count means the model itself changed, not only its speed
+        old_mean = np.mean(old["neighbours_mean"]) if old["neighbours_mean"] else 0.0
+        new_mean = np.mean(result["neighbours_mean"]) if result["neighbours_mean"] else 0.0
+        if not math.isclose(old_mean, new_mean, rel_tol=0.05, abs_tol=0.05):
+            print(f"  warning: {result['key']} averages {new_mean:.2f} neighbours, baseline had {old_mean:.2f}")
+
+        print(
+            f"{result['key']:<44} {result['fps']:>10.2f} {old['fps']:>10.2f} {change:>+8.1%} "
+            f"{result['peak_rss_mb']:>8.1f} {old['peak_rss_mb']:>9.1f} {' '.join(flags)}"
+        )
+        if flags:
+            regressions.append((result["key"], flags))
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless flocking benchmark")
+    parser.add_argument("--counts", type=int, nargs="+", default=[50, 500, 5000, 50000])
+    parser.add_argument("--radii", type=int, nargs="+", default=[25, 50])
+    parser.add_argument("--obstacles", type=int, nargs="+", default=[0, 10])
+    parser.add_argument("--engines", nargs="+", default=["agents", "numpy"], choices=["agents", "numpy"])
+    parser.add_argument("--max-agents-birds", type=int, default=5000, help="largest flock for the per-agent path")
+    parser.add_argument("--frames", type=int, default=30)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--quick", action="store_true", help="50 and 500 birds, radius 50, 10 frames")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", default=os.path.join(HERE, "benchmark_baseline.json"))
+    parser.add_argument("--save-baseline", action="store_true", help="write the results to the baseline file")
+    parser.add_argument("--fps-tolerance", type=float, default=0.2, help="allowed relative fps drop")
+    parser.add_argument("--rss-tolerance", type=float, default=0.2, help="allowed relative peak RSS growth")
+    args = parser.parse_args(argv)
+
+    if args.quick:
+        args.counts, args.radii, args.frames, args.warmup = [50, 500], [50], 10, 2
+
+    cases = build_cases(args)
+    results = []
+
+    # One process per case: a fresh interpreter for every measurement and an honest peak RSS
+    with multiprocessing.get_context("spawn").Pool(1, maxtasksperchild=1) as pool:
+        for result in pool.imap(run_case, cases):
+            print(
+                f"{result['key']:<44} {result['fps']:>10.2f} fps  "
+                f"{result['peak_rss_mb']:>8.1f} MB  {np.mean(result['neighbours_mean'] or [0]):>6.2f} neighbours"
+            )
+            results.append(result)
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cases": results,
+        "scaling": scaling_curves(results),
+    }
+
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=1)
+
+    print()
+    for group, curve in report["scaling"].items():
+        print(f"{group:<30} exponent {curve['exponent']}  fps {curve['fps']}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as file:
+            json.dump(report, file, indent=1)
+        print(f"\nSaved the baseline to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        # Nothing to compare against, the results are still written to args.output
+        print(f"\nWarning: no baseline at {args.baseline}, nothing was compared. Run with --save-baseline to store one")
+        return 0
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+
+    regressions = compare(results, baseline, args.fps_tolerance, args.rss_tolerance)
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) against {args.baseline}:")
+        for key, flags in regressions:
+            print(f"  {key}: {', '.join(flags)}")
+        return 1
+
+    print("\nNo regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
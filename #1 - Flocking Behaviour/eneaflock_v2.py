@@ -2,8 +2,18 @@ from enum import Enum, auto
 import pygame as pg
 import random
 from pygame.math import Vector2
-from vi import Agent, Simulation
+from vi import Agent, HeadlessSimulation, Simulation
 from vi.config import Config, dataclass, deserialize
+from vi.proximity import ProximityIter
+import os
+import sys
+
+# The spatial index is shared with the other assignments, see shared/ one folder up
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from flock_engine import FlockEngine
+from sprite_atlas import atlas_for
+from shared.spatial import ProximityFrame, wrapped
 
 
 @deserialize
@@ -18,6 +28,15 @@ class FlockingConfig(Config):
     delta_time: float = 0.5                                   # To learn more https://gafferongames.com/post/integration_basics/ 
     mass: int = 20                                            
 
+    # "agents" runs Bird.change_position per bird, "numpy" moves the whole flock with FlockEngine
+    engine: str = "agents"
+
+    # "violet" uses violet's own chunks, "grid" and "kdtree" wrap neighbourhoods around the screen edges
+    proximity_backend: str = "violet"
+
+    # Degrees between the pre-rotated frames of the sprite atlas, 0 rotates every bird every frame like violet
+    rotation_step: float = 5
+
     def weights(self) -> tuple[float, float, float]:
         return (self.alignment_weight, self.cohesion_weight, self.separation_weight)
 
@@ -26,7 +45,20 @@ class FlockingConfig(Config):
 class Bird(Agent):
     config: FlockingConfig
 
+    # Neighbours of the current frame, see neighbours()
+    _neighbours: list = []
+    _neighbours_frame: int = -1
+
+    def __init__(self, images, simulation, *args, **kwargs):
+        # Keep the simulation around, it owns the proximity index shared by all birds
+        self.simulation = simulation
+        super().__init__(images, simulation, *args, **kwargs)
+
     def change_position(self):
+        # The numpy engine has already moved this bird in Flocking.before_update
+        if self.config.engine == "numpy":
+            return
+
         # Pac-man-style teleport to the other end of the screen when trying to escape
         self.there_is_no_escape()
         
@@ -35,12 +67,13 @@ class Bird(Agent):
         if not hasattr(self, 'move_initialized'):
             self.move = Vector2(random.uniform(-1, 1), random.uniform(-1, 1)).normalize() * 2
             self.move_initialized = True
-        neighbors = list(self.in_proximity_accuracy())  # retrieves agents in the given radius
+        neighbors = self.neighbours()  # retrieves agents in the given radius, once per frame
 
-        # Calculate alignment, cohesion, and separation forces
-        alignment = self.calculate_alignment(neighbors)
-        separation = self.calculate_separation(neighbors)
-        cohesion = self.calculate_cohesion(neighbors)
+        # Calculate alignment, cohesion, and separation forces from a single pass over the neighbours
+        heading, offset, centre, n_count = self.neighbour_sums(neighbors)
+        alignment = self.calculate_alignment(heading, n_count)
+        separation = self.calculate_separation(offset, n_count)
+        cohesion = self.calculate_cohesion(centre, n_count)
 
         f_total = (alignment + separation + cohesion)
 
@@ -63,21 +96,50 @@ class Bird(Agent):
             self.change_image(0)
             
 
-    def calculate_alignment(self, neighbors):
-        alignment_force = Vector2(0, 0)
-        if not neighbors:
-            return alignment_force
+    def _get_image(self):
+        # Nearest pre-rotated frame from the atlas shared by all birds, instead of rotating the image every frame.
+        # violet's image property still caches the result for the rest of the frame
+        if not self.config.image_rotation or self.config.rotation_step <= 0:
+            return super()._get_image()
+
+        atlas = atlas_for(self.simulation.atlases, self._images, self.config.rotation_step)
+        return atlas.frame(self._image_index, self.move.angle_to(Vector2(0, -1)))
+
+    def change_image(self, index):
+        # change_position picks an image every frame, only swap when the neighbour bucket actually changed
+        if index != self._image_index:
+            super().change_image(index)
+
+    def neighbours(self):
+        # Query the proximity engine once per frame, every other consumer reads the cached list
+        if self._neighbours_frame != self.shared.counter:
+            self._neighbours = list(self.simulation.in_proximity(self))
+            self._neighbours_frame = self.shared.counter
+        return self._neighbours
+
+    def neighbour_sums(self, neighbors):
+        heading = Vector2(0, 0)
+        offset = Vector2(0, 0)
+        centre = Vector2(0, 0)
         n_count = 0
 
-        # Sum the velocities of all neighbors
-        for neighbor, dist in self.in_proximity_accuracy():
+        # Walk the neighbours once and collect the sums of all three rules
+        for neighbor, dist in neighbors:
             if neighbor is not self and dist < self.config.radius:
-                alignment_force += neighbor.move.normalize()
+                towards = wrapped(neighbor.pos - self.pos, *self.config.window.as_tuple())
+                heading += neighbor.move.normalize()
+                offset -= towards / (dist ** 2)
+                centre += towards
                 n_count += 1
-            
+
+        return heading, offset, centre, n_count
+
+    def calculate_alignment(self, heading, n_count):
+        alignment_force = Vector2(0, 0)
+
         if n_count > 0:
-        # Calculate alignment force
-            alignment_force /= n_count
+        # Calculate alignment force from the summed neighbour velocities
+            alignment_force = heading / n_count
             alignment_force = alignment_force.normalize() * self.config.movement_speed
             alignment_force -= self.move
             alignment_force.scale_to_length(self.config.movement_speed) 
@@ -85,24 +147,12 @@ class Bird(Agent):
 
         return alignment_force
     
-    def calculate_separation(self, neighbors):
+    def calculate_separation(self, offset, n_count):
         separation_force = Vector2(0, 0)
-        n_count = 0
 
-        if not neighbors:
-            return separation_force
-        
-        # Sum vector differences to all neighbors
-        for neighbor, dist in self.in_proximity_accuracy():
-            if neighbor is not self and dist < self.config.radius:
-                n_force = self.pos - neighbor.pos
-                n_force /= (dist ** 2)
-                separation_force += n_force
-                n_count += 1
-        
-        # Calculate Separation Force
+        # Calculate Separation Force from the summed vector differences
         if n_count > 0:
-            separation_force /= n_count
+            separation_force = offset / n_count
             separation_force = separation_force.normalize() * self.config.movement_speed
             separation_force -= self.move
             separation_force.scale_to_length(self.config.movement_speed)
@@ -110,23 +160,12 @@ class Bird(Agent):
 
         return separation_force
     
-    def calculate_cohesion(self, neighbors):
+    def calculate_cohesion(self, centre, n_count):
         cohesion_force = Vector2(0, 0)
-        n_count = 0
 
-        if not neighbors:
-            return cohesion_force
-        
-        # Sum positions of all neighbors
-        for neighbor, dist in self.in_proximity_accuracy():
-            if neighbor is not self and dist < self.config.radius:
-                cohesion_force += neighbor.pos
-                n_count += 1
-
-        # Calculate cohesion force
+        # Calculate cohesion force from the summed offsets to the neighbours, i.e. towards their centre
         if n_count > 0:
-            cohesion_force /= n_count
-            cohesion_force -= self.pos
+            cohesion_force = centre / n_count
             cohesion_force = cohesion_force.normalize() * self.config.movement_speed
             cohesion_force -= self.move
             cohesion_force = cohesion_force * self.config.cohesion_weight
@@ -142,9 +181,49 @@ class Selection(Enum):
     SEPARATION = auto()
 
 
-class FlockingLive(Simulation):
-    selection: Selection = Selection.ALIGNMENT
+class Flocking(HeadlessSimulation):
+    # Everything the model needs without a window, the benchmark runs this one directly
     config: FlockingConfig
+    flock: FlockEngine | None = None
+
+    def __init__(self, config):
+        super().__init__(config)
+        width, height = self.config.window.as_tuple()
+        backend = self.config.proximity_backend
+
+        # "violet" keeps using the birds' own in_proximity_accuracy()
+        self.proximity = None if backend == "violet" else ProximityFrame(
+            self._agents, width, height, self.config.radius, backend=backend
+        )
+
+        # Pre-rotated bird images per image list, see sprite_atlas.py, they go away with the simulation
+        self.atlases = {}
+
+    def in_proximity(self, agent):
+        if self.proximity is None:
+            return agent.in_proximity_accuracy()
+        return ProximityIter(self.proximity.in_proximity(agent, self.shared.counter))
+
+    def step_flock(self):
+        birds = self._agents.sprites()
+        if self.flock is None:
+            # Share the toroidal index with the per-agent path, without one the engine mirrors violet's neighbourhoods
+            index = self.proximity.index if self.proximity is not None else None
+            # No obstacle avoidance in this version
+            self.flock = FlockEngine.from_agents(self.config, self.config.window.as_tuple(), birds, index)
+
+        self.flock.step()
+        self.flock.write_back(birds)
+
+    def before_update(self):
+        super().before_update()
+
+        if self.config.engine == "numpy":
+            self.step_flock()
+
+
+class FlockingLive(Flocking, Simulation):
+    selection: Selection = Selection.ALIGNMENT
 
     def handle_event(self, by: float):
         if self.selection == Selection.ALIGNMENT:
@@ -174,18 +253,19 @@ class FlockingLive(Simulation):
         print(f"A: {a:.1f} - C: {c:.1f} - S: {s:.1f}")
 
 
-(
-    FlockingLive(
-        FlockingConfig(
-            image_rotation=True,
-            movement_speed=5,
-            radius=50,
-            seed=1,
+if __name__ == "__main__":
+    (
+        FlockingLive(
+            FlockingConfig(
+                image_rotation=True,
+                movement_speed=5,
+                radius=50,
+                seed=1,
+            )
         )
+        .batch_spawn_agents(50, Bird, images=["Assignments/Assignment_0/images/bird.png",
+                                              "Assignments/Assignment_0/images/red-bird.png",
+                                              "Assignments/Assignment_0/images/green-bird.png"])
+        # .spawn_obstacle("Assignments/Assignment_0/images/triangle@200px.png", x=500 , y= 500)
+        .run()
     )
-    .batch_spawn_agents(50, Bird, images=["Assignments/Assignment_0/images/bird.png",
-                                          "Assignments/Assignment_0/images/red-bird.png",
-                                          "Assignments/Assignment_0/images/green-bird.png"])
-    # .spawn_obstacle("Assignments/Assignment_0/images/triangle@200px.png", x=500 , y= 500)
-    .run()
-)
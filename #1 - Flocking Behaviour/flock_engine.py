@@ -0,0 +1,169 @@
+import random
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+# Struct-of-arrays version of Bird.change_position.
+# Instead of every bird walking its own neighbours with Vector2 maths,
+# the whole flock lives in two (N, 2) arrays and every rule of the
+# per-agent path (alignment, separation, cohesion, obstacle avoidance,
+# mass, speed clamp and delta_time) is applied as a batched array operation.
+#
+# The only behavioural difference: the per-agent path updates birds one after
+# another, so later birds already see the new position of earlier ones.
+# Here every bird reacts to the flock as it was at the start of the frame.
+
+
+def _unit(vectors):
+    # Vector2.normalize() for a whole array, zero vectors stay zero instead of raising
+    length = np.hypot(vectors[:, 0], vectors[:, 1])
+    safe = np.where(length > 0, length, 1.0)
+    return vectors / safe[:, None]
+
+
+def neighbour_pairs(pos, radius):
+    # Directed pairs (i, j, distance) of all birds within the radius of each other,
+    # without wrapping around the screen edges, like violet's own proximity chunks
+    tree = cKDTree(pos)
+    pairs = tree.query_pairs(radius, output_type="ndarray")
+    i = np.concatenate([pairs[:, 0], pairs[:, 1]])
+    j = np.concatenate([pairs[:, 1], pairs[:, 0]])
+    dist = np.hypot(*(pos[i] - pos[j]).T)
+    return i, j, dist
+
+
+class FlockEngine:
+    def __init__(self, config, area, pos, move, index=None, field=None):
+        self.config = config
+        self.width, self.height = area
+
+        # Optional toroidal index from spatial.py, None keeps violet's non-wrapping neighbourhoods
+        self.index = index
+
+        self.pos = np.array(pos, dtype=np.float64).reshape(-1, 2)
+        self.move = np.array(move, dtype=np.float64).reshape(-1, 2)
+
+        # ObstacleField of all obstacles, None for a flock without obstacle avoidance
+        self.field = field
+
+        self.neighbour_count = np.zeros(len(self.pos), dtype=np.int64)
+
+        # (i, j, distance) of the last frame, kept for the order parameters in flock_metrics.py
+        self.pairs = (np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0))
+        self.image_index = np.zeros(len(self.pos), dtype=np.int64)
+
+    @classmethod
+    def from_agents(cls, config, area, agents, index=None, field=None):
+        pos = [(agent.pos.x, agent.pos.y) for agent in agents]
+
+        # Same starting headings as the per-agent path: unit vector of two uniform draws, times 2,
+        # drawn in spawn order so a seeded run starts the same way
+        move = []
+        for _ in agents:
+            x, y = random.uniform(-1, 1), random.uniform(-1, 1)
+            length = (x * x + y * y) ** 0.5
+            move.append((2 * x / length, 2 * y / length))
+
+        return cls(config, area, pos, move, index, field)
+
+    def wrap(self):
+        # Pac-man-style teleport, same rules as Agent.there_is_no_escape
+        x, y = self.pos[:, 0], self.pos[:, 1]
+        x[x < 0] = self.width
+        x[x > self.width] = 0
+        y[y < 0] = self.height
+        y[y > self.height] = 0
+
+    def neighbour_pairs(self):
+        if self.index is None:
+            return neighbour_pairs(self.pos, self.config.radius)
+
+        self.index.rebuild(self.pos)
+        return self.index.pairs(self.config.radius)
+
+    def offsets(self, i, j):
+        # Vectors from bird i to neighbour j, the short way round when the index wraps
+        if self.index is None:
+            return self.pos[j] - self.pos[i]
+        return self.index.delta(self.pos[j], self.pos[i])
+
+    def flocking_forces(self):
+        config = self.config
+        speed = config.movement_speed
+        count = len(self.pos)
+
+        i, j, dist = self.neighbour_pairs()
+        self.pairs = (i, j, dist)
+        self.neighbour_count = np.bincount(i, minlength=count)
+
+        # The force rules only use neighbours strictly inside the radius
+        inside = dist < config.radius
+        i, j, dist = i[inside], j[inside], dist[inside]
+        n = np.bincount(i, minlength=count)
+        has = n > 0
+        n_safe = np.where(has, n, 1)[:, None]
+
+        def per_bird(values):
+            return np.stack([
+                np.bincount(i, weights=values[:, 0], minlength=count),
+                np.bincount(i, weights=values[:, 1], minlength=count),
+            ], axis=1)
+
+        # Alignment: average heading of the neighbours
+        alignment = per_bird(_unit(self.move[j])) / n_safe
+        alignment = _unit(alignment) * speed - self.move
+        alignment = _unit(alignment) * speed * config.alignment_weight
+
+        towards = self.offsets(i, j)
+
+        # Separation: offsets away from the neighbours weighted by the inverse squared distance
+        away = -towards / np.maximum(dist, 1e-9)[:, None] ** 2
+        separation = per_bird(away) / n_safe
+        separation = _unit(separation) * speed - self.move
+        separation = _unit(separation) * speed * config.separation_weight
+
+        # Cohesion: steer towards the centre of the neighbours
+        cohesion = per_bird(towards) / n_safe
+        cohesion = (_unit(cohesion) * speed - self.move) * config.cohesion_weight
+
+        forces = alignment + separation + cohesion
+        forces[~has] = 0
+        return forces
+
+    def obstacle_forces(self):
+        if self.field is None:
+            return np.zeros_like(self.pos)
+
+        # One lookup per bird in the distance field, independent of the number of obstacles
+        return self.field.forces(self.pos, self.config.obstacle_margin, self.config.movement_speed * 10)
+
+    def step(self):
+        config = self.config
+
+        self.wrap()
+
+        f_total = self.flocking_forces() + self.obstacle_forces()
+
+        # Apply the total force (task 7)
+        self.move += f_total / config.mass
+
+        # Clamp to the maximum speed (task 8)
+        speed = np.hypot(self.move[:, 0], self.move[:, 1])
+        too_fast = speed > config.movement_speed
+        self.move[too_fast] *= (config.movement_speed / speed[too_fast])[:, None]
+
+        # Move the birds (task 9)
+        self.pos += self.move * config.delta_time
+
+        # 0 neighbours -> image 0, 1 to 5 -> image 2, more than 5 -> image 1
+        self.image_index = np.where(self.neighbour_count > 5, 1, np.where(self.neighbour_count > 0, 2, 0))
+
+    def write_back(self, agents):
+        # Copy the arrays back onto the sprites so rendering and snapshots keep working
+        for agent, (x, y), (dx, dy), image in zip(
+            agents, self.pos.tolist(), self.move.tolist(), self.image_index.tolist()
+        ):
+            agent.pos.update(x, y)
+            agent.move.update(dx, dy)
+            agent.change_image(image)
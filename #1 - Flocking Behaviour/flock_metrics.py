@@ -0,0 +1,108 @@
+import csv
+
+import numpy as np
+import polars as pl
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+
+# Order parameters of the whole flock, computed from arrays.
+# They reuse the neighbour pairs (i, j, distance) the frame already found for the flocking
+# rules, so nothing here does its own search over all pairs of birds.
+
+COLUMNS = [
+    "frame", "polarization", "angular_momentum",
+    "nn_mean", "nn_median", "nn_min", "isolated", "clusters", "largest_cluster",
+]
+
+
+def _headings(move):
+    length = np.hypot(move[:, 0], move[:, 1])
+    return move / np.where(length > 0, length, 1.0)[:, None]
+
+
+def polarization(move):
+    # Length of the average unit heading: 1 when every bird flies the same way, ~0 when they don't
+    if not len(move):
+        return 0.0
+    return float(np.hypot(*_headings(move).mean(axis=0)))
+
+
+def angular_momentum(pos, move):
+    # Milling: average of the cross product between the unit vector from the flock's centre to
+    # every bird and its unit heading, 1 when the flock circles around its centre.
+    # The centre is taken in screen coordinates, a flock split over the screen edge doesn't mill.
+    if not len(pos):
+        return 0.0
+    radial = _headings(pos - pos.mean(axis=0))
+    heading = _headings(move)
+    return float(abs(np.mean(radial[:, 0] * heading[:, 1] - radial[:, 1] * heading[:, 0])))
+
+
+def nearest_neighbours(i, dist, count):
+    # Distance from every bird to its nearest neighbour, inf for birds without neighbours in the radius
+    nearest = np.full(count, np.inf)
+    np.minimum.at(nearest, i, dist)
+    return nearest
+
+
+def clusters(i, j, count):
+    # Groups of birds connected through neighbour pairs, returns the number of groups and the size of every group
+    # Every pair comes in both directions, one of them is enough for an undirected graph
+    one_way = i < j
+    graph = coo_matrix((np.ones(int(one_way.sum()), dtype=np.int8), (i[one_way], j[one_way])), shape=(count, count))
+    n, labels = connected_components(graph, directed=False)
+    return n, np.bincount(labels, minlength=n)
+
+
+def order_parameters(pos, move, i, j, dist):
+    count = len(pos)
+    nearest = nearest_neighbours(i, dist, count)
+    found = nearest[np.isfinite(nearest)]
+    n, sizes = clusters(i, j, count)
+
+    return {
+        "polarization": polarization(move),
+        "angular_momentum": angular_momentum(pos, move),
+        "nn_mean": float(found.mean()) if len(found) else float("nan"),
+        "nn_median": float(np.median(found)) if len(found) else float("nan"),
+        "nn_min": float(found.min()) if len(found) else float("nan"),
+        "isolated": float(1 - len(found) / count) if count else 0.0,
+        "clusters": int(n),
+        "largest_cluster": float(sizes.max() / count) if count else 0.0,
+    }
+
+
+class FlockMetrics:
+    """Order parameters every `stride` frames, kept in memory and appended to a CSV file while running."""
+
+    def __init__(self, stride=10, path=""):
+        self.stride = stride
+        self.rows = []
+
+        self.writer = None
+        if path:
+            self.file = open(path, "w", newline="")
+            self.writer = csv.DictWriter(self.file, fieldnames=COLUMNS)
+            self.writer.writeheader()
+
+    def due(self, frame):
+        return self.stride > 0 and frame % self.stride == 0
+
+    def sample(self, frame, pos, move, i, j, dist):
+        row = {"frame": frame, **order_parameters(pos, move, i, j, dist)}
+        self.rows.append(row)
+
+        if self.writer is not None:
+            self.writer.writerow(row)
+            self.file.flush()
+        return row
+
+    def close(self):
+        # Close the CSV file, rows sampled afterwards are only kept in memory
+        if self.writer is not None:
+            self.file.close()
+            self.writer = None
+
+    def to_frame(self):
+        return pl.DataFrame(self.rows, schema=COLUMNS) if self.rows else pl.DataFrame(schema=COLUMNS)
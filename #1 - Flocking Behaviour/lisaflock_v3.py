@@ -1,9 +1,24 @@
 from enum import Enum, auto
 import pygame as pg
 import random
+import numpy as np
 from pygame.math import Vector2
-from vi import Agent, Simulation
+from vi import Agent, HeadlessSimulation, Simulation
 from vi.config import Config, dataclass, deserialize
+from vi.proximity import ProximityIter
+import os
+import sys
+
+# The spatial index and frame counters are shared with the other assignments, see shared/ one folder up
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from flock_engine import FlockEngine
+from flock_metrics import FlockMetrics
+from obstacle_field import ObstacleField
+from sprite_atlas import atlas_for
+from shared.frame_metrics import CountBy, FrameMetrics
+from shared.spatial import ProximityFrame, wrapped
+
 import polars as pl
 import seaborn as sb
 
@@ -22,6 +37,28 @@ class FlockingConfig(Config):
     #Change how long the simulation will run for !!!
     # duration: float = 5 * 60                                        
 
+    # "agents" runs Bird.change_position per bird, "numpy" moves the whole flock with FlockEngine
+    engine: str = "agents"
+
+    # "violet" uses violet's own chunks, "grid" and "kdtree" wrap neighbourhoods around the screen edges
+    proximity_backend: str = "violet"
+
+    # Degrees between the pre-rotated frames of the sprite atlas, 0 rotates every bird every frame like violet
+    rotation_step: float = 5
+
+    # Birds start steering away from an obstacle this many pixels before its edge.
+    # 10 matches the old trigger, 70 px around the triangle's centre: that circle ran 10 px outside
+    # the triangle's edge on average and covered the same area outside it as a 10 px band does
+    obstacle_margin: float = 10
+
+    # Frames between two samples of the order parameters (polarization, clusters, ...), 0 turns them off
+    metrics_stride: int = 10
+    # CSV file the samples are appended to while running, empty keeps them in memory only
+    metrics_path: str = ""
+
+    # Also keep violet's per-agent rows in .snapshots, the plot only needs the per-frame counters
+    keep_snapshots: bool = False
+
     def weights(self) -> tuple[float, float, float]:
         return (self.alignment_weight, self.cohesion_weight, self.separation_weight)
 
@@ -29,11 +66,20 @@ class FlockingConfig(Config):
 class Bird(Agent):
     config: FlockingConfig
 
-    #new for the obstacle part
-    obstacle_pos: Vector2 = Vector2(500, 500)
-    avoidance_radius: float = 70
+    # Neighbours of the current frame, see neighbours()
+    _neighbours: list = []
+    _neighbours_frame: int = -1
+
+    def __init__(self, images, simulation, *args, **kwargs):
+        # Keep the simulation around, it owns the proximity index shared by all birds
+        self.simulation = simulation
+        super().__init__(images, simulation, *args, **kwargs)
 
     def change_position(self):
+        # The numpy engine has already moved this bird in Flocking.before_update
+        if self.config.engine == "numpy":
+            return
+
         # Pac-man-style teleport to the other end of the screen when trying to escape
         self.there_is_no_escape()
         
@@ -43,15 +89,16 @@ class Bird(Agent):
             self.move = Vector2(random.uniform(-1, 1), random.uniform(-1, 1)).normalize() * 2
             self.move_initialized = True
 
-        neighbors = list(self.in_proximity_accuracy())  # retrieves agents in the given radius
+        neighbors = self.neighbours()  # retrieves agents in the given radius, once per frame
 
-        # Calculate alignment, cohesion, and separation forces
-        alignment = self.calculate_alignment(neighbors)
-        separation = self.calculate_separation(neighbors)
-        cohesion = self.calculate_cohesion(neighbors)
+        # Calculate alignment, cohesion, and separation forces from a single pass over the neighbours
+        heading, offset, centre, n_count = self.neighbour_sums(neighbors)
+        alignment = self.calculate_alignment(heading, n_count)
+        separation = self.calculate_separation(offset, n_count)
+        cohesion = self.calculate_cohesion(centre, n_count)
 
         #new, for the obstacle 
-        obstacle_avoidance = self.calculate_obstacle_avoidance(self.obstacle_pos, self.avoidance_radius)
+        obstacle_avoidance = self.calculate_obstacle_avoidance()
 
         f_total = (alignment + separation + cohesion + obstacle_avoidance)
 
@@ -74,21 +121,55 @@ class Bird(Agent):
             self.change_image(0)
             
 
-    def calculate_alignment(self, neighbors):
-        alignment_force = Vector2(0, 0)
-        if not neighbors:
-            return alignment_force
+    def _collect_replay_data(self):
+        # One row per bird per frame, only kept when asked for
+        if self.config.keep_snapshots:
+            super()._collect_replay_data()
+
+    def _get_image(self):
+        # Nearest pre-rotated frame from the atlas shared by all birds, instead of rotating the image every frame.
+        # violet's image property still caches the result for the rest of the frame
+        if not self.config.image_rotation or self.config.rotation_step <= 0:
+            return super()._get_image()
+
+        atlas = atlas_for(self.simulation.atlases, self._images, self.config.rotation_step)
+        return atlas.frame(self._image_index, self.move.angle_to(Vector2(0, -1)))
+
+    def change_image(self, index):
+        # change_position picks an image every frame, only swap when the neighbour bucket actually changed
+        if index != self._image_index:
+            super().change_image(index)
+
+    def neighbours(self):
+        # Query the proximity engine once per frame, every other consumer reads the cached list
+        if self._neighbours_frame != self.shared.counter:
+            self._neighbours = list(self.simulation.in_proximity(self))
+            self._neighbours_frame = self.shared.counter
+        return self._neighbours
+
+    def neighbour_sums(self, neighbors):
+        heading = Vector2(0, 0)
+        offset = Vector2(0, 0)
+        centre = Vector2(0, 0)
         n_count = 0
 
-        # Sum the velocities of all neighbors
-        for neighbor, dist in self.in_proximity_accuracy():
+        # Walk the neighbours once and collect the sums of all three rules
+        for neighbor, dist in neighbors:
             if neighbor is not self and dist < self.config.radius:
-                alignment_force += neighbor.move.normalize()
+                towards = wrapped(neighbor.pos - self.pos, *self.config.window.as_tuple())
+                heading += neighbor.move.normalize()
+                offset -= towards / (dist ** 2)
+                centre += towards
                 n_count += 1
-            
+
+        return heading, offset, centre, n_count
+
+    def calculate_alignment(self, heading, n_count):
+        alignment_force = Vector2(0, 0)
+
         if n_count > 0:
-        # Calculate alignment force
-            alignment_force /= n_count
+        # Calculate alignment force from the summed neighbour velocities
+            alignment_force = heading / n_count
             alignment_force = alignment_force.normalize() * self.config.movement_speed
             alignment_force -= self.move
             alignment_force.scale_to_length(self.config.movement_speed) 
@@ -96,24 +177,12 @@ class Bird(Agent):
 
         return alignment_force
     
-    def calculate_separation(self, neighbors):
+    def calculate_separation(self, offset, n_count):
         separation_force = Vector2(0, 0)
-        n_count = 0
 
-        if not neighbors:
-            return separation_force
-        
-        # Sum vector differences to all neighbors
-        for neighbor, dist in self.in_proximity_accuracy():
-            if neighbor is not self and dist < self.config.radius:
-                n_force = self.pos - neighbor.pos
-                n_force /= (dist ** 2)
-                separation_force += n_force
-                n_count += 1
-        
-        # Calculate Separation Force
+        # Calculate Separation Force from the summed vector differences
         if n_count > 0:
-            separation_force /= n_count
+            separation_force = offset / n_count
             separation_force = separation_force.normalize() * self.config.movement_speed
             separation_force -= self.move
             separation_force.scale_to_length(self.config.movement_speed)
@@ -121,40 +190,25 @@ class Bird(Agent):
 
         return separation_force
     
-    def calculate_cohesion(self, neighbors):
+    def calculate_cohesion(self, centre, n_count):
         cohesion_force = Vector2(0, 0)
-        n_count = 0
 
-        if not neighbors:
-            return cohesion_force
-        
-        # Sum positions of all neighbors
-        for neighbor, dist in self.in_proximity_accuracy():
-            if neighbor is not self and dist < self.config.radius:
-                cohesion_force += neighbor.pos
-                n_count += 1
-
-        # Calculate cohesion force
+        # Calculate cohesion force from the summed offsets to the neighbours, i.e. towards their centre
         if n_count > 0:
-            cohesion_force /= n_count
-            cohesion_force -= self.pos
+            cohesion_force = centre / n_count
             cohesion_force = cohesion_force.normalize() * self.config.movement_speed
             cohesion_force -= self.move
             cohesion_force = cohesion_force * self.config.cohesion_weight
 
         return cohesion_force
     
-    def calculate_obstacle_avoidance(self, obstacle_pos, avoidance_radius):
-        avoidance_force = Vector2(0, 0)
-        distance_to_obstacle = self.pos.distance_to(obstacle_pos)
-
-        if distance_to_obstacle < avoidance_radius:
-            avoidance_force = self.pos - obstacle_pos  # Move away from the obstacle
-            avoidance_force /= (distance_to_obstacle ** 2)  # Weigh the force by the square of the distance
-            avoidance_force = avoidance_force.normalize() * self.config.movement_speed
-            avoidance_force = avoidance_force * 10  # Scale the avoidance force, adjust as necessary
-
-        return avoidance_force
+    def calculate_obstacle_avoidance(self):
+        # Move away from the nearest obstacle once the bird is within obstacle_margin of its edge,
+        # the distance field covers every spawned obstacle in a single lookup
+        x, y = self.simulation.obstacle_field.force(
+            self.pos.x, self.pos.y, self.config.obstacle_margin, self.config.movement_speed * 10  # Scale the avoidance force, adjust as necessary
+        )
+        return Vector2(x, y)
 
         #END CODE -----------------
 
@@ -165,9 +219,97 @@ class Selection(Enum):
     SEPARATION = auto()
 
 
-class FlockingLive(Simulation):
-    selection: Selection = Selection.ALIGNMENT
+class Flocking(HeadlessSimulation):
+    # Everything the model needs without a window, the benchmark runs this one directly
     config: FlockingConfig
+    flock: FlockEngine | None = None
+    obstacle_field: ObstacleField | None = None
+
+    def __init__(self, config):
+        super().__init__(config)
+        width, height = self.config.window.as_tuple()
+        backend = self.config.proximity_backend
+
+        # "violet" keeps using the birds' own in_proximity_accuracy()
+        self.proximity = None if backend == "violet" else ProximityFrame(
+            self._agents, width, height, self.config.radius, backend=backend
+        )
+
+        # Pre-rotated bird images per image list, see sprite_atlas.py, they go away with the simulation
+        self.atlases = {}
+
+        # Birds per image every frame, instead of grouping the snapshots after the run
+        self.frame_metrics = FrameMetrics(CountBy("image_index", lambda agent: agent._image_index, [0, 1, 2]))
+        self.order_metrics = FlockMetrics(self.config.metrics_stride, self.config.metrics_path)
+
+    def in_proximity(self, agent):
+        if self.proximity is None:
+            return agent.in_proximity_accuracy()
+        return ProximityIter(self.proximity.in_proximity(agent, self.shared.counter))
+
+    def step_flock(self):
+        birds = self._agents.sprites()
+        if self.flock is None:
+            # Share the toroidal index with the per-agent path, without one the engine mirrors violet's neighbourhoods
+            index = self.proximity.index if self.proximity is not None else None
+            self.flock = FlockEngine.from_agents(self.config, self.config.window.as_tuple(), birds, index, self.obstacle_field)
+
+        self.flock.step()
+        self.flock.write_back(birds)
+
+    def before_update(self):
+        super().before_update()
+
+        # Obstacles are spawned after __init__, the distance field is built from them on the first frame
+        if self.obstacle_field is None:
+            self.obstacle_field = ObstacleField.from_sprites(self._obstacles, *self.config.window.as_tuple())
+
+        if self.config.engine == "numpy":
+            self.step_flock()
+
+    def neighbour_data(self):
+        # Positions, headings and the neighbour pairs (i, j, distance) this frame already found
+        if self.flock is not None:
+            return (self.flock.pos, self.flock.move, *self.flock.pairs)
+
+        birds = self._agents.sprites()
+        pos = np.array([(bird.pos.x, bird.pos.y) for bird in birds], dtype=np.float64).reshape(-1, 2)
+        move = np.array([(bird.move.x, bird.move.y) for bird in birds], dtype=np.float64).reshape(-1, 2)
+
+        if self.proximity is not None and self.proximity.frame == self.shared.counter:
+            # The index's pair lists, its members are the birds in sprite order
+            counts = np.diff(self.proximity.offset)
+            i = np.repeat(np.arange(len(counts)), counts)
+            return pos, move, i, self.proximity.neighbour, self.proximity.dist
+
+        # violet's own proximity: the neighbour lists every bird cached this frame
+        slots = {bird.id: slot for slot, bird in enumerate(birds)}
+        i, j, dist = [], [], []
+        for slot, bird in enumerate(birds):
+            for other, d in bird._neighbours:
+                i.append(slot)
+                j.append(slots[other.id])
+                dist.append(d)
+        return pos, move, np.array(i, dtype=np.int64), np.array(j, dtype=np.int64), np.array(dist, dtype=np.float64)
+
+    def after_update(self):
+        self.frame_metrics.update(self.shared.counter, self._agents)
+
+        if self.order_metrics.due(self.shared.counter):
+            self.order_metrics.sample(self.shared.counter, *self.neighbour_data())
+
+        super().after_update()
+
+    def run(self):
+        # The order parameter CSV is closed however the run ends: duration, stop(), closing the window or an error
+        try:
+            return super().run()
+        finally:
+            self.order_metrics.close()
+
+
+class FlockingLive(Flocking, Simulation):
+    selection: Selection = Selection.ALIGNMENT
 
     def handle_event(self, by: float):
         if self.selection == Selection.ALIGNMENT:
@@ -196,33 +338,34 @@ class FlockingLive(Simulation):
         a, c, s = self.config.weights()
         print(f"A: {a:.1f} - C: {c:.1f} - S: {s:.1f}")
 
-flocking_config = FlockingConfig(
-    image_rotation=True,
-    movement_speed=5,
-    radius=50,
-    seed=1,
-)
 
-flocking_simulation = FlockingLive(flocking_config)
+if __name__ == "__main__":
+    flocking_config = FlockingConfig(
+        image_rotation=True,
+        movement_speed=5,
+        radius=50,
+        seed=1,
+    )
+
+    flocking_simulation = FlockingLive(flocking_config)
+
+    (
+        flocking_simulation.batch_spawn_agents(
+            50, 
+            Bird, 
+            images=["Assignments/Assignment_0/images/bird.png",
+                    "Assignments/Assignment_0/images/red-bird.png",
+                    "Assignments/Assignment_0/images/green-bird.png"])
 
-df = (
-    flocking_simulation.batch_spawn_agents(
-        50, 
-        Bird, 
-        images=["Assignments/Assignment_0/images/bird.png",
-                "Assignments/Assignment_0/images/red-bird.png",
-                "Assignments/Assignment_0/images/green-bird.png"])
+        .spawn_obstacle("Assignments/Assignment_0/images/triangle@200px.png", x=500 , y=500)
 
-    .spawn_obstacle("Assignments/Assignment_0/images/triangle@200px.png", x=500 , y=500)
+        .run()
+    )
 
-    .run()
-    .snapshots
-    .groupby(["frame", "image_index"])
-    .agg(pl.count("id").alias("agents"))
-    .sort(["frame", "image_index"])
-)
+    df = flocking_simulation.frame_metrics.long("image_index")
 
-print(df)
+    print(df)
 
-plot = sb.relplot(x=df["frame"], y=df["agents"], hue=df["image_index"], kind="line")
-plot.savefig("Assignments/Assignment_1/agents.png", dpi=300)
\ No newline at end of file
+    plot = sb.relplot(x=df["frame"], y=df["agents"], hue=df["image_index"], kind="line")
+    plot.savefig("Assignments/Assignment_1/agents.png", dpi=300)
+    flocking_simulation.frame_metrics.save("Assignments/Assignment_1/agents.npz")
\ No newline at end of file
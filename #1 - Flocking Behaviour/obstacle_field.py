@@ -0,0 +1,83 @@
+import math
+
+import numpy as np
+import pygame as pg
+from scipy import ndimage
+
+
+# Signed distance field of all obstacles, built once from the obstacle images.
+# Every cell holds the distance to the nearest obstacle pixel (negative inside an obstacle)
+# and the direction in which that distance grows, i.e. away from the closest obstacle.
+# Avoidance is then one array lookup per bird, however many obstacles there are.
+
+# Big windows get coarser cells so the grid stays at most this many cells per side
+MAX_CELLS = 1024
+
+
+class ObstacleField:
+    def __init__(self, mask, cell=1.0):
+        # mask is indexed [y, x] and True where an obstacle covers the cell
+        self.cell = cell
+        self.ny, self.nx = mask.shape
+        self.empty = not mask.any()
+
+        if self.empty:
+            return
+
+        # Distance to the nearest obstacle cell outside, minus the distance to the nearest free cell inside
+        outside = ndimage.distance_transform_edt(~mask)
+        inside = ndimage.distance_transform_edt(mask)
+        self.distance = ((outside - inside) * cell).astype(np.float32)
+
+        # Only the direction of the gradient is used, so it is stored as a unit vector
+        gy, gx = np.gradient(self.distance)
+        length = np.hypot(gx, gy)
+        length[length == 0] = np.inf
+        self.direction = np.stack([gx / length, gy / length], axis=-1).astype(np.float32)
+
+    @classmethod
+    def from_sprites(cls, sprites, width, height, threshold=127):
+        # Rasterise the opaque pixels of every obstacle sprite (e.g. simulation._obstacles)
+        cell = max(1.0, max(width, height) / MAX_CELLS)
+        mask = np.zeros((math.ceil(height / cell), math.ceil(width / cell)), dtype=bool)
+
+        for sprite in sprites:
+            # surfarray is indexed [x, y]
+            xs, ys = np.nonzero(pg.surfarray.array_alpha(sprite.image) > threshold)
+            cx = ((xs + sprite.rect.left) // cell).astype(np.int64)
+            cy = ((ys + sprite.rect.top) // cell).astype(np.int64)
+
+            keep = (cx >= 0) & (cx < mask.shape[1]) & (cy >= 0) & (cy < mask.shape[0])
+            mask[cy[keep], cx[keep]] = True
+
+        return cls(mask, cell)
+
+    def cells(self, pos):
+        # Grid cell of every position, positions outside the window use the nearest edge cell
+        cells = (np.asarray(pos, dtype=np.float64).reshape(-1, 2) // self.cell).astype(np.int64)
+        return np.clip(cells[:, 0], 0, self.nx - 1), np.clip(cells[:, 1], 0, self.ny - 1)
+
+    def forces(self, pos, margin, strength):
+        # Push of the given strength away from the nearest obstacle for every position within the margin
+        pos = np.asarray(pos, dtype=np.float64).reshape(-1, 2)
+        forces = np.zeros_like(pos)
+        if self.empty:
+            return forces
+
+        cx, cy = self.cells(pos)
+        near = self.distance[cy, cx] < margin
+        forces[near] = self.direction[cy[near], cx[near]] * strength
+        return forces
+
+    def force(self, x, y, margin, strength):
+        # forces() for a single bird, without building arrays
+        if self.empty:
+            return 0.0, 0.0
+
+        cx = min(max(int(x // self.cell), 0), self.nx - 1)
+        cy = min(max(int(y // self.cell), 0), self.ny - 1)
+        if self.distance[cy, cx] >= margin:
+            return 0.0, 0.0
+
+        dx, dy = self.direction[cy, cx].tolist()
+        return dx * strength, dy * strength
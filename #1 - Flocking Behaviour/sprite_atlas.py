@@ -0,0 +1,35 @@
+import pygame as pg
+
+
+# Pre-rotated copies of the agent images.
+# With image_rotation violet calls pg.transform.rotate for every agent every frame,
+# here every image is rotated once per angular step and agents pick the nearest copy.
+# The atlases belong to a simulation (a dict on it, see atlas_for), so they go away with it.
+
+
+class SpriteAtlas:
+    def __init__(self, images, step=5.0):
+        self.step = step
+        self.count = max(1, round(360 / step))
+
+        # Surfaces converted to the display format blit a lot faster, only possible once a window exists
+        convert = pg.display.get_surface() is not None
+
+        self.frames = []
+        for image in images:
+            rotated = [pg.transform.rotate(image, slot * 360 / self.count) for slot in range(self.count)]
+            self.frames.append([frame.convert_alpha() for frame in rotated] if convert else rotated)
+
+    def frame(self, index, angle):
+        # Nearest pre-rotated frame of image `index` for an angle in degrees, like pg.transform.rotate(image, angle)
+        return self.frames[index][round(angle * self.count / 360) % self.count]
+
+
+def atlas_for(atlases, images, step):
+    # atlases is the simulation's dict of atlases per (images list, step),
+    # all agents of one batch_spawn_agents call share the same list
+    key = (id(images), step)
+    if key not in atlases:
+        # Keep the images list alive next to its atlas so its id can't be reused by another list
+        atlases[key] = (images, SpriteAtlas(images, step))
+    return atlases[key][1]
@@ -0,0 +1,154 @@
+import argparse
+import dataclasses
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import product
+
+import polars as pl
+
+from lisaflock_v3 import Bird, Flocking, FlockingConfig
+
+
+# Headless parameter sweep over the flocking weights.
+# Every point (a set of FlockingConfig overrides) runs once per seed in a process pool.
+# Each finished run is written to its own small parquet file under <out>/parts, named after
+# a hash of everything that affects the result, so an interrupted sweep picks up where it
+# stopped. At the end all parts are combined into <out>/results.parquet, one row per run.
+#
+#   python sweep.py --alignment 0.5 1 1.5 --cohesion 0.25 0.5 1 --separation 0.3 0.6 1.2 --seeds 1 2 3
+#   python sweep.py --points points.json --seeds 1 2       # [{"alignment_weight": 1.0, ...}, ...]
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+IMAGES = [os.path.join(HERE, "images", name) for name in ("bird.png", "red-bird.png", "green-bird.png")]
+
+# Same starting point as the script in lisaflock_v3.py
+BASE = dict(image_rotation=True, movement_speed=5, radius=50)
+
+
+def run_id(point):
+    # Stable name of a run: everything that changes its outcome, in a fixed order
+    return hashlib.sha1(json.dumps(point, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def run_point(point):
+    # One headless run, returns its summary row
+    overrides = {key: value for key, value in point.items() if key not in ("birds", "frames", "stride")}
+    config = FlockingConfig(**{**BASE, **overrides, "duration": point["frames"], "metrics_stride": point["stride"]})
+
+    start = time.perf_counter()
+    simulation = Flocking(config)
+    simulation.batch_spawn_agents(point["birds"], Bird, images=IMAGES).run()
+    seconds = time.perf_counter() - start
+
+    # Order parameters averaged over the second half of the run, once the flock had time to form
+    samples = simulation.order_metrics.to_frame()
+    if samples.is_empty():
+        raise ValueError(f"{run_id(point)} took no order parameter samples, check frames and stride")
+    settled = samples.filter(pl.col("frame") >= point["frames"] / 2)
+    if settled.is_empty():
+        # Fewer frames than the stride, only frame 0 was sampled
+        settled = samples
+    final = samples.row(-1, named=True)
+
+    occupancy, images = simulation.frame_metrics.counts("image_index")
+    occupancy = occupancy.mean(axis=0) / point["birds"]
+
+    return {
+        "run_id": run_id(point),
+        **point,
+        "seconds": round(seconds, 3),
+        "polarization_mean": settled["polarization"].mean(),
+        "polarization_final": final["polarization"],
+        "angular_momentum_mean": settled["angular_momentum"].mean(),
+        "nn_mean": settled["nn_mean"].mean(),
+        "clusters_mean": settled["clusters"].mean(),
+        "clusters_final": final["clusters"],
+        "largest_cluster_final": final["largest_cluster"],
+        **{f"image_{image}": float(share) for image, share in zip(images, occupancy)},
+    }
+
+
+def grid(**values):
+    # Every combination of the given override lists, e.g. grid(alignment_weight=[0.5, 1], seed=[1, 2])
+    keys = list(values)
+    return [dict(zip(keys, combination)) for combination in product(*values.values())]
+
+
+def sweep(points, out, birds=50, frames=1000, stride=10, workers=None):
+    # Run all points that don't have a part file yet and combine every part into one table
+    parts = os.path.join(out, "parts")
+    os.makedirs(parts, exist_ok=True)
+
+    # Fail early on a typo in a field name or a run without samples, not hours later in a worker
+    if stride < 1 or frames < 1:
+        raise ValueError(f"frames ({frames}) and stride ({stride}) have to be at least 1")
+    fields = {field.name for field in dataclasses.fields(FlockingConfig)}
+    for point in points:
+        unknown = set(point) - fields
+        if unknown:
+            raise ValueError(f"{sorted(unknown)} are not FlockingConfig fields")
+
+    points = [{**point, "birds": birds, "frames": frames, "stride": stride} for point in points]
+    todo = [point for point in points if not os.path.exists(os.path.join(parts, f"{run_id(point)}.parquet"))]
+    print(f"{len(points) - len(todo)} of {len(points)} runs already done, {len(todo)} to go")
+
+    # spawn instead of fork: every worker starts with a clean pygame and violet
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = {pool.submit(run_point, point): point for point in todo}
+        for done, future in enumerate(as_completed(futures), 1):
+            row = future.result()
+            path = os.path.join(parts, f"{row['run_id']}.parquet")
+
+            # Write next to the final name and rename, a killed sweep never leaves half a part behind
+            pl.DataFrame([row]).write_parquet(path + ".tmp")
+            os.replace(path + ".tmp", path)
+            print(f"[{done}/{len(todo)}] {row['run_id']} polarization {row['polarization_mean']:.2f} "
+                  f"clusters {row['clusters_mean']:.1f} ({row['seconds']:.1f}s)")
+
+    results = pl.concat(
+        [pl.read_parquet(os.path.join(parts, f"{run_id(point)}.parquet")) for point in points],
+        how="diagonal",
+    )
+    results.write_parquet(os.path.join(out, "results.parquet"))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Parallel sweep over the flocking weights")
+    parser.add_argument("--alignment", type=float, nargs="+", default=[1.0])
+    parser.add_argument("--cohesion", type=float, nargs="+", default=[0.5])
+    parser.add_argument("--separation", type=float, nargs="+", default=[0.6])
+    parser.add_argument("--points", help="JSON list of FlockingConfig overrides, used instead of the weight grid")
+    parser.add_argument("--seeds", type=int, nargs="+", default=[1])
+    parser.add_argument("--engine", default="numpy", choices=["agents", "numpy"])
+    parser.add_argument("--proximity-backend", default="kdtree", choices=["violet", "grid", "kdtree"])
+    parser.add_argument("--birds", type=int, default=50)
+    parser.add_argument("--frames", type=int, default=1000)
+    parser.add_argument("--stride", type=int, default=10, help="frames between order parameter samples")
+    parser.add_argument("--workers", type=int, default=None, help="processes, all cores by default")
+    parser.add_argument("--out", default="sweep_results")
+    args = parser.parse_args(argv)
+    if args.stride < 1:
+        parser.error("--stride has to be at least 1, 0 would turn off the order parameters the sweep reports")
+    if args.frames < 1:
+        parser.error("--frames has to be at least 1")
+
+    if args.points:
+        with open(args.points) as file:
+            variants = json.load(file)
+    else:
+        variants = grid(alignment_weight=args.alignment, cohesion_weight=args.cohesion, separation_weight=args.separation)
+
+    fixed = {"engine": args.engine, "proximity_backend": args.proximity_backend}
+    points = [{**fixed, **variant, "seed": seed} for variant, seed in product(variants, args.seeds)]
+
+    results = sweep(points, args.out, args.birds, args.frames, args.stride, args.workers)
+    print(results)
+
+
+if __name__ == "__main__":
+    main()
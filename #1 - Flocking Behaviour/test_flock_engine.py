@@ -0,0 +1,53 @@
+import os
+import random
+
+import numpy as np
+import pytest
+from pygame.math import Vector2
+from vi.config import Window
+
+from flock_engine import FlockEngine
+from lisaflock_v3 import Bird, Flocking, FlockingConfig
+from obstacle_field import ObstacleField
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+IMAGES = [os.path.join(HERE, "images", name) for name in ("bird.png", "red-bird.png", "green-bird.png")]
+
+
+@pytest.mark.parametrize("backend", ["grid", "kdtree"])
+def test_flock_engine_matches_the_per_agent_path(backend):
+    # One frame from the same start on both paths. The per-agent path moves the birds one after another,
+    # so every bird is put back where it started once it moved, and all of them react to the start of the frame
+    random.seed(2)
+    config = FlockingConfig(
+        movement_speed=5, radius=40, seed=2, window=Window.square(300), proximity_backend=backend, obstacle_margin=40
+    )
+    simulation = Flocking(config)
+    simulation.spawn_obstacle(os.path.join(HERE, "images", "triangle@50px.png"), x=150, y=150)
+    simulation.batch_spawn_agents(80, Bird, images=IMAGES)
+    simulation.obstacle_field = ObstacleField.from_sprites(simulation._obstacles, *config.window.as_tuple())
+
+    birds = simulation._agents.sprites()
+    for bird in birds:
+        bird.move = Vector2(random.uniform(-1, 1), random.uniform(-1, 1)).normalize() * 2
+        bird.move_initialized = True
+    pos = np.array([(bird.pos.x, bird.pos.y) for bird in birds])
+    move = np.array([(bird.move.x, bird.move.y) for bird in birds])
+
+    moved, images = [], []
+    for bird, start, heading in zip(birds, pos.tolist(), move.tolist()):
+        bird.change_position()
+        moved.append((bird.pos.x, bird.pos.y, bird.move.x, bird.move.y))
+        images.append(bird._image_index)
+        bird.pos.update(start)
+        bird.move.update(heading)
+
+    flock = FlockEngine(config, config.window.as_tuple(), pos, move, simulation.proximity.index, simulation.obstacle_field)
+    flock.step()
+
+    assert np.allclose(np.hstack([flock.pos, flock.move]), moved)
+    assert flock.image_index.tolist() == images
+    # Every rule had something to do: birds with neighbours, birds without and birds near the obstacle
+    assert 0 < (flock.neighbour_count > 0).sum() < len(birds)
+    assert simulation.obstacle_field.forces(pos, config.obstacle_margin, 1).any()
@@ -1,38 +1,64 @@
-from enum import Enum, auto
 import pygame as pg
 import random
 from pygame.math import Vector2
-from vi import Agent, Simulation, HeadlessSimulation
+from vi import Agent, HeadlessSimulation, Simulation
 from vi.config import Config, dataclass, deserialize
 import numpy as np
 import polars as pl
 import seaborn as sns
 import pandas as pd 
+from dataclasses import field
+import os
+import sys
 
-# Define agent states
-class State(Enum):
-    WANDERING = auto()
-    JOINING = auto()
-    STILL = auto()
-    LEAVING = auto()
+# The spatial index, frame counters and convergence monitor are shared with the other assignments, see shared/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from aggregation_engine import AggregationEngine, State
+from clusters import ClusterTracker
+from probabilities import tables_for
+from sites import Site, SiteMap, SiteStates
+from shared.convergence import ConvergenceMonitor
+from shared.frame_metrics import CountBy, FrameMetrics
+from shared.spatial import ProximityFrame
 
 @deserialize
 @dataclass
 class AggregationsConfig(Config):
     t_join: float = 5.0  # Time to join
     t_leave: float = 5.0  # Time to leave
-    a = 3 # PARAMETER A
-    b = 5 #  PARAMETER B
+    a: float = 3 # PARAMETER A
+    b: float = 5 #  PARAMETER B
+    join_scale: float = 0.5  # p_join = 0.03 + join_scale * (1 - exp(-a * neighbours))
+    join_curve: str = "exponential"  # Name of the p_join curve in probabilities.JOIN_CURVES
+    leave_curve: str = "exponential"  # Name of the p_leave curve in probabilities.LEAVE_CURVES, exp(-b * neighbours)
     delta_time: float = 0.5
     mass: int = 20
     width: int = 800
     height: int = 600
+    proximity_backend: str = "violet"  # "violet" (in_proximity_accuracy, edges don't wrap), or the toroidal "grid" or "kdtree" (periodic KD-tree, copes with crowded sites)
+    verlet_skin: float = 0  # Extra reach of the cached neighbour lists (grid and kdtree), 0 rebuilds every frame
+    engine: str = "agents"  # "agents" runs Cockroach.change_position per agent, "numpy" steps all of them with AggregationEngine (same model, not the same runs, see aggregation_engine.py)
+    dormancy: bool = True  # numpy engine: still cockroaches keep their index entries and update their neighbour counts incrementally ("kdtree" and "violet" backends only)
+    cluster_stride: int = 10  # Frames between samples of the clusters of still cockroaches, 0 turns them off
+    stop_when_steady: bool = False  # End the run once the state shares settled (convergence.py), the reason ends up in .monitor
+    steady_window: int = 1500  # Frames per window of the steady state check, aggregation drifts slowly
+    steady_tolerance: float = 0.01  # Largest change of a state share between two windows that still counts as settled
+    keep_snapshots: bool = False  # Also keep violet's per-agent rows in .snapshots, the plot only needs frame_metrics
+
+    # Aggregation sites, drawn from their image and used as a disc of the given radius (radius 0: the image's own shape)
+    sites: list[Site] = field(default_factory=lambda: [
+        Site(600, 375, "Assignments/Assignment_1/images/circle_filled_150pxx.png", radius=55),
+        Site(175, 375, "Assignments/Assignment_1/images/circle_filled_200pxx.png", radius=75),
+    ])
 
 class Cockroach(Agent):
     config: AggregationsConfig
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
+    def __init__(self, images, simulation, *args, **kwargs):
+        # Keep the simulation around, it owns the proximity index shared by all agents
+        self.simulation = simulation
+        super().__init__(images, simulation, *args, **kwargs)
         self.state = 'wander'
         self.join_timer = 0
         self.leave_timer = 0
@@ -41,6 +67,10 @@ class Cockroach(Agent):
         self.move = Vector2(random.uniform(-1, 1), random.uniform(-1, 1)).normalize()
 
     def change_position(self):
+        # The numpy engine has already moved this cockroach in AggregationsSimulation.before_update
+        if self.config.engine == "numpy":
+            return
+
         self.there_is_no_escape()
 
         if self.state == 'wander':
@@ -63,7 +93,7 @@ class Cockroach(Agent):
 
         # Check if agent enters a site
         if self.in_aggregation_site():
-            p_join: float = 0.03 + 0.5*(1 - np.exp(-self.config.a * self.count_neighbors())) # Probability to Join
+            p_join: float = tables_for(self.config).join(self.count_neighbors()) # Probability to Join
             if random.random() > p_join:
                 self.state = 'join'
 
@@ -83,7 +113,7 @@ class Cockroach(Agent):
 
         neighbors = self.count_neighbors()
         # print(self.p_leave)
-        p_leave: float = np.exp(-((self.config.b) * (self.count_neighbors())))  # Probability to leave
+        p_leave: float = tables_for(self.config).leave(neighbors)  # Probability to leave
         if random.random() < p_leave:
             #self.move = -self.move  
             self.state = 'leave'
@@ -99,14 +129,16 @@ class Cockroach(Agent):
             self.leave_timer = 0
 
     def in_aggregation_site(self):
-        sites = [(Vector2(600, 375), 55), (Vector2(175, 375), 75)]  # list of sites with their centers and radii
-        for site_center, site_radius in sites:
-            if self.pos.distance_to(site_center) < site_radius:
-                return True
-        return False
+        # One lookup in the rasterised sites, however many there are
+        return self.simulation.site_map.site_of(self.pos.x, self.pos.y) >= 0
 
     def count_neighbors(self):
-        return len(list(self.in_proximity_accuracy()))  # get neighbors
+        return self.simulation.count_neighbors(self)
+
+    def _collect_replay_data(self):
+        # One row per agent per frame adds up to millions of rows, only kept when asked for
+        if self.config.keep_snapshots:
+            super()._collect_replay_data()
 
     def add_randomness(self, vector, magnitude):
         random_perturbation = Vector2(random.uniform(-magnitude, magnitude), random.uniform(-magnitude, magnitude))
@@ -114,28 +146,121 @@ class Cockroach(Agent):
 
         return new_vector.normalize()
 
-class AggregationsSimulation(Simulation):
+class Aggregations(HeadlessSimulation):
     config: AggregationsConfig
+    engine: AggregationEngine | None = None
+
+    def __init__(self, config):
+        super().__init__(config)
+        width, height = self.config.window.as_tuple()
+        backend = self.config.proximity_backend
+
+        # "violet" keeps using the agents' own in_proximity_accuracy()
+        self.proximity = None if backend == "violet" else ProximityFrame(
+            self._agents, width, height, self.config.radius, backend=backend, skin=self.config.verlet_skin
+        )
+
+        # The sites of the config, drawn and rasterised from the same declaration so they can't drift apart
+        self.site_map = SiteMap(self.config.sites, width, height)
+        self.site_map.spawn(self)
+
+        # Clusters of still cockroaches, connected like the neighbour counts (toroidal unless backend is "violet")
+        self.clusters = ClusterTracker(
+            width, height, self.config.radius, self.site_map, self.config.cluster_stride, periodic=backend != "violet"
+        )
+
+        # Counters per frame, filled in after_update instead of grouping the snapshots afterwards.
+        # "sites" counts every state per site, so site sizes can be compared directly
+        self.frame_metrics = FrameMetrics(
+            CountBy("state", lambda agent: agent.state, ["wander", "join", "still", "leave"]),
+            SiteStates("sites", self.site_map, ["wander", "join", "still", "leave"]),
+        )
+
+        # Watches the state shares, only stops the run with stop_when_steady
+        self.monitor = ConvergenceMonitor(
+            ["wander", "join", "still", "leave"], self.config.steady_window, self.config.steady_tolerance
+        )
+
+    def count_neighbors(self, agent):
+        if self.proximity is None:
+            return len(list(agent.in_proximity_accuracy()))
+        # Read from the counts of all agents, taken in one batched call the first time any agent asks this frame
+        return self.proximity.count(agent, self.shared.counter)
+
+    def step_engine(self):
+        agents = self._agents.sprites()
+        if self.engine is None:
+            # Share the toroidal index with the per-agent path, without one the engine counts like violet
+            index = self.proximity.index if self.proximity is not None else None
+            self.engine = AggregationEngine.from_agents(
+                self.config, self.config.window.as_tuple(), agents, self.site_map, index
+            )
+
+        self.engine.step()
+        self.engine.write_back(agents)
+
+    def before_update(self):
+        super().before_update()
+
+        if self.config.engine == "numpy":
+            self.step_engine()
+
+    def sample_clusters(self, frame):
+        if self.engine is not None:
+            pos, still = self.engine.pos, self.engine.state == State.STILL.value
+        else:
+            agents = self._agents.sprites()
+            pos = [(agent.pos.x, agent.pos.y) for agent in agents]
+            still = [agent.state == "still" for agent in agents]
+
+        # The toroidal index hands over its neighbour pairs, its slots are the agents' order (nobody is born or dies here)
+        pairs = self.proximity.pairs(frame) if self.proximity is not None else None
+        self.clusters.sample(frame, pos, still, pairs)
+
+    def after_update(self):
+        self.frame_metrics.update(self.shared.counter, self._agents)
+
+        if self.config.stop_when_steady:
+            counts, _ = self.frame_metrics.counts("state")
+            if self.monitor.update(self.shared.counter, counts[-1] / max(1, len(self._agents))):
+                self.stop()
+
+        if self.clusters.due(self.shared.counter):
+            self.sample_clusters(self.shared.counter)
+        super().after_update()
+
+
+class AggregationsSimulation(Aggregations, Simulation):
+    # The same model in a window, Aggregations alone runs headless (see scenarios.py)
+    pass
+
+
+if __name__ == "__main__":
+    # Simulation setup
+    aggregations_simulation = AggregationsSimulation(AggregationsConfig(fps_limit=0, duration= 60*100))
 
-# Simulation setup
-aggregations_simulation = AggregationsSimulation(AggregationsConfig(fps_limit=0, duration= 60*100))
+    (aggregations_simulation.batch_spawn_agents(25, Cockroach, images=["Assignments/Assignment_1/images/green.png",
+                                                                        "Assignments/Assignment_1/images/red.png",
+                                                                        "Assignments/Assignment_1/images/white.png"])
+          .run()
+          )
 
-df = (aggregations_simulation.batch_spawn_agents(25, Cockroach, images=["Assignments/Assignment_1/images/green.png",
-                                                                         "Assignments/Assignment_1/images/red.png",
-                                                                         "Assignments/Assignment_1/images/white.png"])
-      .spawn_site("Assignments/Assignment_1/images/circle_filled_150pxx.png", x=600, y=375)
-      .spawn_site("Assignments/Assignment_1/images/circle_filled_200pxx.png", x=175, y=375)
-      .run()
-      .snapshots.group_by(["frame","image_index"])
-      .agg(pl.count("id").alias("agents"))
-      .sort(["frame","image_index"])
-      )
+    # Still cockroaches per site, straight from the per-site counters
+    frames = aggregations_simulation.frame_metrics.frame()
+    sites = aggregations_simulation.frame_metrics.reducers["sites"]
+    df = sites.series(frames, "still")
 
-print(df)
+    print(df)
+    print(f"Majority aggregated at frame {sites.time_to_majority(frames)}, site choice {sites.site_choice().round(2)}")
 
-plot = sns.relplot( x=df["frame"]/1000, y=df["agents"], hue=df["image_index"], kind="line")
+    plot = sns.relplot( x=df["frame"]/1000, y=df["agents"], hue=df["site"], kind="line")
 
 
-plot.set(xlabel="Time (s)", ylabel="Number of agents")
-plot.savefig("agents.png", dpi=300)
+    plot.set(xlabel="Time (s)", ylabel="Still agents per site")
+    plot.savefig("agents.png", dpi=300)
+    aggregations_simulation.frame_metrics.save("agents.npz")
+    sites.save("occupancy.npz", frames)
 
+    # Cluster formation over the run: clusters and the largest one per sample, plus the size histogram
+    aggregations_simulation.clusters.to_frame().write_csv("clusters.csv")
+    aggregations_simulation.clusters.sizes().write_csv("cluster_sizes.csv")
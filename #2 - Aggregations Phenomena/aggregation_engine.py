@@ -0,0 +1,201 @@
+from enum import Enum, auto
+import os
+import sys
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from probabilities import tables_for
+from shared.spatial import DormantCounts, PeriodicKDTree
+
+
+# Struct-of-arrays version of Cockroach.change_position.
+# State, timers, positions and headings of all cockroaches live in NumPy arrays and every
+# transition of the state machine is a masked update of the whole population per frame.
+#
+# Same rules as the per-agent path, with two differences:
+# - every cockroach counts its neighbours at the positions of the start of the frame,
+#   the per-agent path counts them after the cockroaches before it in the group already moved
+# - the random draws come from a NumPy generator seeded with config.seed, not from `random`
+# so a run is not the same run as with engine = "agents", only the same model.
+#
+# How far apart the two are, mean still count over the last 500 of 2000 frames, 50 cockroaches,
+# seeds 0-39 (the standard deviation between seeds is 5-7 cockroaches, so 1 per mean):
+#   APSameSize       agents 15.1  numpy 14.3
+#   APDifferentSize  agents 13.5  numpy 15.4
+# Within two standard errors both ways. A handful of seeds can be much further apart
+# (4 seeds gave 18.1 against 14.8), compare engines over tens of seeds.
+# Counting after this frame's moves instead of before doesn't bring them closer (13.9 for APSameSize).
+
+
+# Define agent states
+class State(Enum):
+    WANDERING = auto()
+    JOINING = auto()
+    STILL = auto()
+    LEAVING = auto()
+
+
+# Cockroach.state strings and the State they stand for
+STATES = {
+    "wander": State.WANDERING,
+    "join": State.JOINING,
+    "still": State.STILL,
+    "leave": State.LEAVING,
+}
+NAMES = {state.value: name for name, state in STATES.items()}
+
+# Image per state, indexed by State value: wandering 0, still 1, joining and leaving 2
+IMAGES = np.zeros(max(state.value for state in State) + 1, dtype=np.int8)
+IMAGES[[State.WANDERING.value, State.JOINING.value, State.STILL.value, State.LEAVING.value]] = [0, 2, 1, 2]
+
+
+def _unit(vectors):
+    length = np.hypot(vectors[:, 0], vectors[:, 1])
+    return vectors / np.where(length > 0, length, 1.0)[:, None]
+
+
+class AggregationEngine:
+    def __init__(self, config, area, pos, move, site_map, index=None, state=None, join_timer=None, leave_timer=None):
+        self.config = config
+        self.width, self.height = area
+
+        # Optional toroidal index from spatial.py, None counts neighbours without wrapping like violet
+        self.index = index
+
+        # Still cockroaches don't move, with dormancy they stay out of the per-frame search and
+        # their counts only change when moving cockroaches come or go or neighbours freeze or wake up.
+        # DormantCounts keeps its own KD-trees, periodic for "kdtree" and plain for "violet", a grid would be ignored
+        if config.dormancy and index is not None and not isinstance(index, PeriodicKDTree):
+            raise ValueError(
+                f"dormancy only works with the \"kdtree\" and \"violet\" backends, not {type(index).__name__}, "
+                f"set dormancy = false to use it"
+            )
+        self.dormant = DormantCounts(self.width, self.height, config.radius, periodic=index is not None) if config.dormancy else None
+
+        self.pos = np.array(pos, dtype=np.float64).reshape(-1, 2)
+        self.move = np.array(move, dtype=np.float64).reshape(-1, 2)
+        count = len(self.pos)
+
+        self.state = np.full(count, State.WANDERING.value, dtype=np.int8) if state is None else np.asarray(state, dtype=np.int8)
+        self.join_timer = np.zeros(count) if join_timer is None else np.asarray(join_timer, dtype=np.float64)
+        self.leave_timer = np.zeros(count) if leave_timer is None else np.asarray(leave_timer, dtype=np.float64)
+
+        # SiteMap from sites.py, one lookup tells every cockroach which site it is in
+        self.site_map = site_map
+
+        self.image_index = IMAGES[self.state]
+        self.neighbour_count = np.zeros(count, dtype=np.int64)
+
+        # What write_back has to copy onto the sprites, everything at first
+        self.moved = np.ones(count, dtype=bool)
+        self.updated = np.ones(count, dtype=bool)
+        self.shown = np.full(count, -1, dtype=np.int8)
+        self.rng = np.random.default_rng(config.seed)
+
+    @classmethod
+    def from_agents(cls, config, area, agents, site_map, index=None):
+        # Carry over whatever state the cockroaches are in, usually all wandering at the first frame
+        pos = [(agent.pos.x, agent.pos.y) for agent in agents]
+        move = [(agent.move.x, agent.move.y) for agent in agents]
+        state = [STATES[agent.state].value for agent in agents]
+        join_timer = [agent.join_timer for agent in agents]
+        leave_timer = [agent.leave_timer for agent in agents]
+        return cls(config, area, pos, move, site_map, index, state, join_timer, leave_timer)
+
+    def wrap(self):
+        # Pac-man-style teleport, same rules as Agent.there_is_no_escape, returns who was teleported
+        x, y = self.pos[:, 0], self.pos[:, 1]
+        outside = (x < 0) | (x > self.width) | (y < 0) | (y > self.height)
+        x[x < 0] = self.width
+        x[x > self.width] = 0
+        y[y < 0] = self.height
+        y[y > self.height] = 0
+        return outside
+
+    def neighbour_counts(self, still=None):
+        # Only the number of neighbours matters here, the trees count them without listing the pairs
+        if self.dormant is not None and still is not None:
+            return self.dormant.counts(self.pos, still)
+
+        if self.index is None:
+            if not len(self.pos):
+                return np.zeros(0, dtype=np.int64)
+            return cKDTree(self.pos).query_ball_point(self.pos, self.config.radius, return_length=True).astype(np.int64) - 1
+
+        self.index.rebuild(self.pos)
+        return self.index.counts(self.config.radius)
+
+    def in_site(self, pos):
+        # True for every position inside at least one aggregation site
+        return self.site_map.lookup(pos) >= 0
+
+    def step(self):
+        config = self.config
+        wrapped = self.wrap()
+
+        # Every cockroach acts on the state it started the frame in, and shows that state's image
+        state = self.state.copy()
+        self.image_index = IMAGES[state]
+
+        wandering = state == State.WANDERING.value
+        joining = state == State.JOINING.value
+        still = state == State.STILL.value
+        leaving = state == State.LEAVING.value
+
+        n = self.neighbour_count = self.neighbour_counts(still)
+        tables = tables_for(config)
+
+        # Wander: random walk, joins with probability 1 - p_join once inside a site (the per-agent `random() > p_join`)
+        self.pos[wandering] += self.move[wandering]
+        noise = self.rng.uniform(-0.1, 0.1, size=(int(wandering.sum()), 2))
+        self.move[wandering] = _unit(self.move[wandering] + noise)
+
+        p_join = tables.join.gather(n)
+        draw = self.rng.random(len(state))
+        self.state[wandering & self.in_site(self.pos) & (draw > p_join)] = State.JOINING.value
+
+        # Join: keep walking until the join timer runs out, then stay still
+        self.pos[joining] += self.move[joining]
+        self.join_timer[joining] += config.delta_time
+        done = joining & (self.join_timer >= config.t_join)
+        self.state[done] = State.STILL.value
+        self.join_timer[done] = 0
+
+        # Still: leave with p_leave
+        p_leave = tables.leave.gather(n)
+        self.state[still & (draw < p_leave)] = State.LEAVING.value
+
+        # Leave: keep walking until the leave timer runs out, then wander again
+        self.pos[leaving] += self.move[leaving]
+        self.leave_timer[leaving] += config.delta_time
+        done = leaving & (self.leave_timer >= config.t_leave)
+        self.state[done] = State.WANDERING.value
+        self.leave_timer[done] = 0
+
+        # Still cockroaches don't move, and only joining and leaving ones have running timers
+        self.moved = ~still | wrapped
+        self.updated = joining | leaving | (self.state != state)
+
+    def write_back(self, agents):
+        # Copy what changed this frame back onto the sprites so rendering, snapshots and frame_metrics keep working
+        moved = np.flatnonzero(self.moved)
+        for k, (x, y), (dx, dy) in zip(moved.tolist(), self.pos[moved].tolist(), self.move[moved].tolist()):
+            agents[k].pos.update(x, y)
+            agents[k].move.update(dx, dy)
+
+        updated = np.flatnonzero(self.updated)
+        for k, state, join_timer, leave_timer in zip(
+            updated.tolist(), self.state[updated].tolist(),
+            self.join_timer[updated].tolist(), self.leave_timer[updated].tolist(),
+        ):
+            agents[k].state = NAMES[state]
+            agents[k].join_timer = join_timer
+            agents[k].leave_timer = leave_timer
+
+        changed = np.flatnonzero(self.image_index != self.shown)
+        for k, image in zip(changed.tolist(), self.image_index[changed].tolist()):
+            agents[k].change_image(image)
+        self.shown = self.image_index.copy()
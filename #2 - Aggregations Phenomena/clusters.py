@@ -0,0 +1,160 @@
+import numpy as np
+import polars as pl
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
+
+
+# Clusters of still cockroaches: still cockroaches within the radius of each other are connected.
+# A union-find over the slots of the agents keeps the clusters between samples. Still cockroaches
+# don't move, so between two samples only the ones that froze or woke up change the graph:
+# - a cockroach that froze is merged with the clusters of its still neighbours
+# - a cockroach that woke up can split its cluster, only that cluster is taken apart and connected again
+# The parent array is kept flat (every slot points straight at its root), so find() is a lookup.
+# The neighbour pairs come from the simulation's proximity index when it has one (ProximityFrame.pairs),
+# only the "violet" backend leaves the tracker to search its own KD-tree.
+
+SUMMARY = ["frame", "still", "clusters", "largest", "mean_size"]
+
+
+class ClusterTracker:
+    def __init__(self, width, height, radius, site_map=None, stride=10, periodic=True):
+        self.size = np.array([width, height], dtype=np.float64)
+        self.radius = radius
+        self.site_map = site_map
+        self.stride = stride
+        # periodic=False connects without wrapping around the edges, like violet
+        self.periodic = periodic
+
+        self.parent = np.zeros(0, dtype=np.int64)
+        self.still = np.zeros(0, dtype=bool)
+        self.pos = np.empty((0, 2))
+
+        self.rows = []
+        self.histogram = []
+        self.occupancy = []
+
+    def due(self, frame):
+        return self.stride > 0 and frame % self.stride == 0
+
+    def _tree(self, pos):
+        if self.periodic:
+            pos = np.mod(pos, self.size)
+            return cKDTree(np.where(pos >= self.size, 0.0, pos), boxsize=self.size)
+        return cKDTree(pos)
+
+    def find(self, slots):
+        return self.parent[slots]
+
+    def union(self, a, b):
+        # Merge the clusters of every pair (a[k], b[k]) at once, each merged cluster keeps one of its roots
+        if not len(a):
+            return
+        roots, inverse = np.unique(np.concatenate([self.find(a), self.find(b)]), return_inverse=True)
+        graph = coo_matrix(
+            (np.ones(len(a), dtype=np.int8), (inverse[:len(a)], inverse[len(a):])), shape=(len(roots), len(roots))
+        )
+        _, component = connected_components(graph, directed=False)
+
+        # First root of every component becomes the root of all of them
+        _, first = np.unique(component, return_index=True)
+        relabel = np.arange(len(self.parent))
+        relabel[roots] = roots[first][component]
+        self.parent = relabel[self.parent]
+
+    def _neighbours(self, pos, slots, among, pairs):
+        # (a, b) for every neighbour b of slots[k] that is also in the among mask, pairs (i, j) within the
+        # radius at pos in either or both directions, None searches a tree of the among slots instead
+        if pairs is not None:
+            i, j = (np.asarray(side, dtype=np.int64) for side in pairs)
+            a, b = np.concatenate([i, j]), np.concatenate([j, i])
+            asked = np.zeros(len(among), dtype=bool)
+            asked[slots] = True
+            keep = asked[a] & among[b] & (a != b)
+            return a[keep], b[keep]
+
+        members = np.flatnonzero(among)
+        tree = self._tree(pos[members])
+        found = tree.query_ball_point(pos[slots], self.radius)
+        lengths = np.fromiter((len(rows) for rows in found), dtype=np.int64, count=len(found))
+        rows = np.fromiter((row for rows in found for row in rows), dtype=np.int64, count=int(lengths.sum()))
+        return np.repeat(slots, lengths), members[rows]
+
+    def update(self, pos, still, pairs=None):
+        # pos (N, 2) and the still mask of all agents, indexed by slot, slots stay the same between calls.
+        # pairs are the neighbour pairs (i, j) of all agents at pos, None searches the still ones here
+        pos = np.asarray(pos, dtype=np.float64).reshape(-1, 2)
+        still = np.asarray(still, dtype=bool)
+        if len(still) != len(self.still):
+            # New population, everything starts on its own
+            self.parent = np.arange(len(still))
+            self.still = np.zeros(len(still), dtype=bool)
+            self.pos = pos.copy()
+
+        # Still at both samples but somewhere else: woke up and froze again in between
+        moved = self.still & still & (pos != self.pos).any(axis=1)
+        left = np.flatnonzero(self.still & (~still | moved))
+        joined = np.flatnonzero(still & (~self.still | moved))
+        self.pos = pos.copy()
+
+        if len(left):
+            self.split(left, still & ~moved, pairs)
+        self.still = still.copy()
+
+        if len(joined):
+            # Neighbours among all still cockroaches, the new ones included
+            self.union(*self._neighbours(pos, joined, still, pairs))
+
+    def split(self, left, stay, pairs=None):
+        # Take apart every cluster that lost a member and connect what is left of it again
+        broken = np.isin(self.parent, self.parent[left])
+        self.parent[broken] = np.flatnonzero(broken)
+
+        members = broken & stay
+        if members.sum() > 1:
+            self.union(*self._neighbours(self.pos, np.flatnonzero(members), members, pairs))
+
+    def sample(self, frame, pos, still, pairs=None):
+        self.update(pos, still, pairs)
+
+        slots = np.flatnonzero(self.still)
+        sizes = np.bincount(self.parent[slots], minlength=len(self.parent))
+        sizes = sizes[sizes > 0]
+
+        row = {
+            "frame": frame,
+            "still": len(slots),
+            "clusters": len(sizes),
+            "largest": int(sizes.max()) if len(sizes) else 0,
+            "mean_size": float(sizes.mean()) if len(sizes) else 0.0,
+        }
+        self.rows.append(row)
+
+        # Number of clusters of every size
+        histogram = np.bincount(sizes)
+        for size in np.flatnonzero(histogram).tolist():
+            self.histogram.append((frame, size, int(histogram[size])))
+
+        # Still cockroaches per site, -1 for the ones outside every site
+        if self.site_map is not None:
+            site = self.site_map.lookup(self.pos[slots])
+            counts = np.bincount(site + 1, minlength=len(self.site_map.sites) + 1)
+            for k, count in enumerate(counts.tolist()):
+                self.occupancy.append((frame, k - 1, count))
+        return row
+
+    def clusters(self):
+        # Slots of the still cockroaches of every cluster at the last sample
+        slots = np.flatnonzero(self.still)
+        order = np.argsort(self.parent[slots], kind="stable")
+        _, starts = np.unique(self.parent[slots][order], return_index=True)
+        return np.split(slots[order], starts[1:])
+
+    def to_frame(self):
+        return pl.DataFrame(self.rows, schema=SUMMARY, orient="row") if self.rows else pl.DataFrame(schema=SUMMARY)
+
+    def sizes(self):
+        return pl.DataFrame(self.histogram, schema=["frame", "size", "clusters"], orient="row")
+
+    def sites(self):
+        return pl.DataFrame(self.occupancy, schema=["frame", "site", "still"], orient="row")
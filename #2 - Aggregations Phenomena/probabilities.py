@@ -0,0 +1,65 @@
+import numpy as np
+
+
+# Join and leave probabilities as lookup tables indexed by the number of neighbours.
+# The neighbour count is a small integer, so every curve is evaluated once for 0, 1, 2, ...
+# and a frame only gathers from the table, for one cockroach or for all of them at once.
+#
+# Curves are picked by name in the config (join_curve / leave_curve). A sensitivity study
+# can add its own by putting a function of (neighbour counts array, config) in the dicts below:
+#
+#   JOIN_CURVES["linear"] = lambda n, config: np.minimum(1, 0.03 + config.join_scale * n / 10)
+
+JOIN_CURVES = {
+    "exponential": lambda n, config: 0.03 + config.join_scale * (1 - np.exp(-config.a * n)),
+}
+
+LEAVE_CURVES = {
+    "exponential": lambda n, config: np.exp(-config.b * n),
+}
+
+# Tables per (curves, parameters), built again only when one of them changes
+_tables = {}
+
+
+class ProbabilityTable:
+    def __init__(self, curve, config, size=64):
+        self.curve = curve
+        self.config = config
+        self.build(size)
+
+    def build(self, size):
+        self.values = np.asarray(self.curve(np.arange(size), self.config), dtype=np.float64)
+        # Plain floats for the per-agent path, indexing a list is faster than indexing an array with one int
+        self.floats = self.values.tolist()
+
+    def __call__(self, n):
+        # Probability for one neighbour count
+        if n >= len(self.floats):
+            self.build(2 * n)
+        return self.floats[n]
+
+    def gather(self, n):
+        # Probabilities for an array of neighbour counts
+        if len(n) and n.max() >= len(self.values):
+            self.build(2 * int(n.max()))
+        return self.values[n]
+
+
+class Probabilities:
+    def __init__(self, config):
+        if config.join_curve not in JOIN_CURVES:
+            raise ValueError(f"unknown join curve {config.join_curve!r}, choose from {sorted(JOIN_CURVES)}")
+        if config.leave_curve not in LEAVE_CURVES:
+            raise ValueError(f"unknown leave curve {config.leave_curve!r}, choose from {sorted(LEAVE_CURVES)}")
+
+        self.join = ProbabilityTable(JOIN_CURVES[config.join_curve], config)
+        self.leave = ProbabilityTable(LEAVE_CURVES[config.leave_curve], config)
+
+
+def tables_for(config):
+    # Everything the curves read, a config changed between runs gets fresh tables
+    key = (config.join_curve, config.leave_curve, config.a, config.b, config.join_scale)
+    if key not in _tables:
+        _tables[key] = Probabilities(config)
+    return _tables[key]
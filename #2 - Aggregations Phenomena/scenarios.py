@@ -0,0 +1,247 @@
+import argparse
+import dataclasses
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+import tomllib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import matplotlib.pyplot as plt
+import numpy as np
+import polars as pl
+from scipy import stats
+
+from APSameSize import Aggregations, AggregationsConfig, Cockroach
+from sites import Site
+
+
+# Headless aggregation experiments, many seeds per scenario.
+# Scenarios (site layout, a, b, t_join, t_leave, population, ...) come from a TOML file, see
+# scenarios.toml. Every replicate runs in a process pool and its per-frame state occupancy is
+# written to its own parquet file under <out>/parts, named after a hash of everything that
+# affects the run, so an interrupted experiment picks up where it stopped. A replicate that settled
+# early (stop_when_steady) holds its last occupancy until the end of the duration. At the end:
+#   <out>/occupancy.parquet  scenario, seed, frame, state, agents, share, one row per replicate per frame per state
+#   <out>/replicates.parquet scenario, seed, stopped_at, reason, seconds, majority_frame (first frame with more
+#                            than half of them still in a site) and site_<k> (share of site k in the still
+#                            cockroaches over the last 10% of the run), one row per replicate
+#   <out>/ensemble.parquet   mean share per scenario, frame and state with its confidence band over the seeds
+#   <out>/<scenario>.png     the ensemble mean with the band
+#
+#   python scenarios.py scenarios.toml --out aggregation_results
+#   python scenarios.py scenarios.toml --only same_size --seeds 5 --workers 4
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+IMAGES = [os.path.join(HERE, "images", name) for name in ("green.png", "red.png", "white.png")]
+
+STATES = ["wander", "join", "still", "leave"]
+
+# Keys of a scenario that aren't AggregationsConfig fields
+RUNNER_KEYS = ("population", "seeds")
+
+
+def load(path):
+    # {scenario name: settings}, every scenario on top of [defaults]
+    with open(path, "rb") as file:
+        document = tomllib.load(file)
+
+    defaults = document.get("defaults", {})
+    scenarios = {name: {**defaults, **settings} for name, settings in document.get("scenarios", {}).items()}
+    if not scenarios:
+        raise ValueError(f"{path} has no [scenarios.<name>] tables")
+
+    # Fail early on a typo in a field name, not hours later in a worker
+    fields = {field.name for field in dataclasses.fields(AggregationsConfig)}
+    for name, settings in scenarios.items():
+        unknown = set(settings) - fields - set(RUNNER_KEYS)
+        if unknown:
+            raise ValueError(f"scenario {name!r}: {sorted(unknown)} are not AggregationsConfig fields")
+    return scenarios
+
+
+def seeds_of(settings):
+    seeds = settings.get("seeds", 1)
+    return list(range(1, seeds + 1)) if isinstance(seeds, int) else list(seeds)
+
+
+def make_config(settings, seed):
+    fields = {key: value for key, value in settings.items() if key not in RUNNER_KEYS}
+    if "sites" in fields:
+        # Site images by name from images/, like the cockroach images
+        fields["sites"] = [
+            Site(**{**site, "image": os.path.join(HERE, "images", site["image"])}) for site in fields["sites"]
+        ]
+    return AggregationsConfig(**fields, seed=seed)
+
+
+def run_id(name, settings, seed):
+    # Stable name of a replicate: everything that changes its outcome, in a fixed order
+    point = {key: value for key, value in settings.items() if key != "seeds"}
+    digest = hashlib.sha1(json.dumps(point, sort_keys=True).encode()).hexdigest()[:12]
+    return f"{name}-{seed}-{digest}"
+
+
+def occupancy_of(name, seed, frames, counts, population, duration=None):
+    # Long format occupancy of one replicate: counts (frames, states) in the order of STATES.
+    # With a duration a run that settled early is fast-forwarded: nothing changes anymore,
+    # so its last frame stands for the rest of the duration
+    frames = np.asarray(frames, dtype=np.int32)
+    if duration is not None and len(frames) and frames[-1] < duration:
+        rest = np.arange(frames[-1] + 1, duration + 1, dtype=frames.dtype)
+        frames = np.concatenate([frames, rest])
+        counts = np.concatenate([counts, np.repeat(counts[-1:], len(rest), axis=0)])
+
+    return pl.DataFrame({
+        "scenario": name,
+        "seed": seed,
+        "frame": np.repeat(frames, len(STATES)),
+        "state": STATES * len(frames),
+        "agents": counts.ravel(),
+    }).with_columns(share=pl.col("agents") / population)
+
+
+def read_parts(paths):
+    # Parts written before the frames were kept as int32 may have int64 frames
+    return pl.concat([pl.read_parquet(path).with_columns(pl.col("frame").cast(pl.Int32)) for path in paths])
+
+
+def read_infos(paths):
+    # One row per replicate. A run that went the full duration has no stopped_at (a null column in its part),
+    # so the rows are put together again instead of concatenating the parts' schemas
+    return pl.DataFrame([row for path in paths for row in pl.read_parquet(path).to_dicts()])
+
+
+def run_replicate(task):
+    # One headless run, returns its state occupancy per frame in long format
+    name, settings, seed = task
+
+    start = time.perf_counter()
+    simulation = Aggregations(make_config(settings, seed))
+    simulation.batch_spawn_agents(settings["population"], Cockroach, images=IMAGES).run()
+    seconds = time.perf_counter() - start
+
+    counts, categories = simulation.frame_metrics.counts("state")
+    counts = counts[:, [categories.index(state) for state in STATES]]
+    frames = simulation.frame_metrics.frame()
+
+    duration = simulation.config.duration if simulation.monitor.stopped else None
+    occupancy = occupancy_of(name, seed, frames, counts, settings["population"], duration)
+
+    sites = simulation.frame_metrics.reducers["sites"]
+    choice = sites.site_choice()
+    info = {
+        "scenario": name,
+        "seed": seed,
+        **simulation.monitor.summary(),
+        "seconds": round(seconds, 3),
+        "majority_frame": sites.time_to_majority(simulation.frame_metrics.frame()),
+        **{f"site_{site}": float(share) for site, share in enumerate(choice)},
+    }
+    return occupancy, info
+
+
+def ensemble(occupancy, level=0.95):
+    # Mean share of every state per frame over the seeds, with a t-based confidence interval of the mean
+    summary = (
+        occupancy.group_by(["scenario", "frame", "state"])
+        .agg(
+            mean=pl.col("share").mean(),
+            std=pl.col("share").std(),
+            replicates=pl.col("seed").n_unique(),
+        )
+        .sort(["scenario", "state", "frame"])
+    )
+
+    # No band with a single replicate
+    n = summary["replicates"].to_numpy()
+    std = summary["std"].fill_null(np.nan).to_numpy()
+    with np.errstate(invalid="ignore", divide="ignore"):
+        half = stats.t.ppf((1 + level) / 2, n - 1) * std / np.sqrt(n)
+
+    return summary.with_columns(
+        ci_low=pl.Series(summary["mean"].to_numpy() - half),
+        ci_high=pl.Series(summary["mean"].to_numpy() + half),
+    )
+
+
+def plot(summary, out, level=0.95):
+    for (name,), frame in summary.group_by(["scenario"]):
+        fig, ax = plt.subplots(figsize=(8, 4.5))
+        for state in STATES:
+            rows = frame.filter(pl.col("state") == state)
+            ax.plot(rows["frame"], rows["mean"], label=state)
+            ax.fill_between(rows["frame"], rows["ci_low"], rows["ci_high"], alpha=0.25)
+
+        replicates = frame["replicates"].max()
+        ax.set(xlabel="Frame", ylabel="Share of cockroaches", title=f"{name} ({replicates} seeds, {level:.0%} CI)")
+        ax.legend()
+        fig.savefig(os.path.join(out, f"{name}.png"), dpi=150, bbox_inches="tight")
+        plt.close(fig)
+
+
+def run(scenarios, out, workers=None, level=0.95):
+    # Run all replicates that don't have a part file yet and combine every part
+    parts = os.path.join(out, "parts")
+    os.makedirs(parts, exist_ok=True)
+
+    tasks = [(name, settings, seed) for name, settings in scenarios.items() for seed in seeds_of(settings)]
+    todo = [task for task in tasks if not os.path.exists(os.path.join(parts, f"{run_id(*task)}.parquet"))]
+    print(f"{len(tasks) - len(todo)} of {len(tasks)} replicates already done, {len(todo)} to go")
+
+    # spawn instead of fork: every worker starts with a clean pygame and violet
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = {pool.submit(run_replicate, task): task for task in todo}
+        for done, future in enumerate(as_completed(futures), 1):
+            task = futures[future]
+            occupancy, info = future.result()
+            path = os.path.join(parts, run_id(*task))
+
+            # Write next to the final name and rename, a killed run never leaves half a part behind.
+            # The info goes first, a part only counts as done once its occupancy is there
+            pl.DataFrame([info]).write_parquet(path + ".info.parquet")
+            occupancy.write_parquet(path + ".tmp")
+            os.replace(path + ".tmp", path + ".parquet")
+
+            still = occupancy.filter(pl.col("state") == "still")["share"][-1]
+            print(f"[{done}/{len(todo)}] {task[0]} seed {task[2]}: {still:.0%} still at the end, "
+                  f"{info['reason']} ({info['seconds']:.1f}s)")
+
+    occupancy = read_parts([os.path.join(parts, f"{run_id(*task)}.parquet") for task in tasks])
+    occupancy.write_parquet(os.path.join(out, "occupancy.parquet"))
+
+    replicates = read_infos([os.path.join(parts, f"{run_id(*task)}.info.parquet") for task in tasks])
+    replicates.write_parquet(os.path.join(out, "replicates.parquet"))
+
+    summary = ensemble(occupancy, level)
+    summary.write_parquet(os.path.join(out, "ensemble.parquet"))
+    plot(summary, out, level)
+    return occupancy, summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Multi-seed aggregation experiments from a scenario file")
+    parser.add_argument("scenarios", nargs="?", default=os.path.join(HERE, "scenarios.toml"))
+    parser.add_argument("--only", nargs="+", help="names of the scenarios to run, all of them by default")
+    parser.add_argument("--seeds", type=int, help="replicates per scenario, overrides the file")
+    parser.add_argument("--level", type=float, default=0.95, help="confidence level of the bands")
+    parser.add_argument("--workers", type=int, default=None, help="processes, all cores by default")
+    parser.add_argument("--out", default="aggregation_results")
+    args = parser.parse_args(argv)
+
+    scenarios = load(args.scenarios)
+    if args.only:
+        missing = set(args.only) - set(scenarios)
+        if missing:
+            raise SystemExit(f"no scenarios named {sorted(missing)} in {args.scenarios}")
+        scenarios = {name: scenarios[name] for name in args.only}
+    if args.seeds:
+        scenarios = {name: {**settings, "seeds": args.seeds} for name, settings in scenarios.items()}
+
+    _, summary = run(scenarios, args.out, args.workers, args.level)
+    print(summary.filter(pl.col("frame") == pl.col("frame").max()))
+
+
+if __name__ == "__main__":
+    main()
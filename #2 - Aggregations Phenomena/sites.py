@@ -0,0 +1,139 @@
+import os
+import sys
+
+import numpy as np
+import polars as pl
+import pygame as pg
+from vi.config import dataclass, deserialize
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from shared.frame_metrics import _Rows
+
+
+# Aggregation sites, declared once in the config and rasterised into a site-id map of the window.
+# "Which site am I in" is then a single array lookup, for one agent or for all of them at once,
+# however many sites there are and whatever their shape.
+
+
+@deserialize
+@dataclass
+class Site:
+    x: int
+    y: int
+    image: str  # Drawn by spawn_site, centred on (x, y)
+    radius: float = 0  # Disc of this radius around (x, y), 0 uses the opaque pixels of the image as the site
+
+
+class SiteMap:
+    def __init__(self, sites, width, height, threshold=127):
+        self.sites = list(sites)
+        self.width, self.height = width, height
+
+        # Index of the site covering every pixel, [y, x], -1 outside all sites.
+        # Drawn last to first, so where sites overlap the one declared first wins
+        self.ids = np.full((height, width), -1, dtype=np.int16)
+        for k in reversed(range(len(self.sites))):
+            left, top, footprint = self.footprint(self.sites[k], threshold)
+            self.paint(k, left, top, footprint)
+
+    @staticmethod
+    def footprint(site, threshold):
+        # (left, top, mask) of the pixels covered by the site, mask indexed [y, x]
+        if site.radius > 0:
+            r = int(np.ceil(site.radius))
+            left, top = site.x - r, site.y - r
+            # Pixel centres strictly inside the radius, like pos.distance_to(centre) < radius
+            ys, xs = np.mgrid[top:site.y + r + 1, left:site.x + r + 1] + 0.5
+            return left, top, np.hypot(xs - site.x, ys - site.y) < site.radius
+
+        # Same placement as violet's spawn_site: the image rect centred on (x, y)
+        image = pg.image.load(site.image)
+        rect = image.get_rect()
+        rect.center = (site.x, site.y)
+        return rect.left, rect.top, pg.surfarray.array_alpha(image).T > threshold
+
+    def paint(self, k, left, top, footprint):
+        # Clip the footprint to the window before writing it into the map
+        h, w = footprint.shape
+        x0, y0 = max(left, 0), max(top, 0)
+        x1, y1 = min(left + w, self.width), min(top + h, self.height)
+        if x0 >= x1 or y0 >= y1:
+            return
+
+        area = footprint[y0 - top:y1 - top, x0 - left:x1 - left]
+        self.ids[y0:y1, x0:x1][area] = k
+
+    def lookup(self, pos):
+        # Site index for an (N, 2) array of positions, -1 for positions outside every site
+        pos = np.asarray(pos, dtype=np.float64).reshape(-1, 2)
+        x = np.clip(pos[:, 0].astype(np.int64), 0, self.width - 1)
+        y = np.clip(pos[:, 1].astype(np.int64), 0, self.height - 1)
+        return self.ids[y, x]
+
+    def site_of(self, x, y):
+        # lookup() for a single position
+        return int(self.ids[min(max(int(y), 0), self.height - 1), min(max(int(x), 0), self.width - 1)])
+
+    def spawn(self, simulation):
+        # Draw every site where the logic expects it
+        for site in self.sites:
+            simulation.spawn_site(site.image, x=site.x, y=site.y)
+
+
+class SiteStates:
+    """Number of agents per (site, state) every frame, a FrameMetrics reducer. Site -1 holds the agents outside every site."""
+
+    def __init__(self, name, site_map, states, key=lambda agent: agent.state):
+        self.name = name
+        self.site_map = site_map
+        self.states = list(states)
+        self.key = key
+
+        self.codes = {state: code for code, state in enumerate(self.states)}
+        self.sites = list(range(-1, len(site_map.sites)))
+        self.categories = [f"{site}/{state}" for site in self.sites for state in self.states]
+        self.rows = _Rows(len(self.categories))
+
+    def update(self, agents):
+        # One site lookup and one bincount for all agents
+        pos = np.array([(agent.pos.x, agent.pos.y) for agent in agents], dtype=np.float64).reshape(-1, 2)
+        state = np.array([self.codes[self.key(agent)] for agent in agents], dtype=np.int64)
+        site = self.site_map.lookup(pos).astype(np.int64) + 1
+        self.rows.append(np.bincount(site * len(self.states) + state, minlength=len(self.categories)))
+
+    def array(self):
+        # (frames, sites x states), the columns named in self.categories
+        return self.rows.array()
+
+    def cube(self):
+        # (frames, sites, states), sites in the order of self.sites
+        return self.array().reshape(-1, len(self.sites), len(self.states))
+
+    def series(self, frames, state="still"):
+        # frame, site, agents for one state, sites only
+        counts = self.cube()[:, 1:, self.codes[state]]
+        return pl.DataFrame({
+            "frame": np.repeat(frames, counts.shape[1]),
+            "site": np.tile(self.sites[1:], len(counts)),
+            "agents": counts.ravel(),
+        })
+
+    def time_to_majority(self, frames, share=0.5, state="still"):
+        # First frame with more than `share` of all agents in `state` inside a site, None if it never happened
+        cube = self.cube()
+        inside = cube[:, 1:, self.codes[state]].sum(axis=1)
+        reached = np.flatnonzero(inside > share * cube.sum(axis=(1, 2)))
+        return int(frames[reached[0]]) if len(reached) else None
+
+    def site_choice(self, tail=0.1, state="still"):
+        # Share of every site in the agents in `state` inside a site, averaged over the last `tail` of the frames
+        cube = self.cube()
+        last = cube[-max(1, int(tail * len(cube))):, 1:, self.codes[state]].sum(axis=0)
+        return last / last.sum() if last.sum() else np.zeros(len(last))
+
+    def save(self, path, frames):
+        # The compact (frame x site x state) array with its axes
+        np.savez_compressed(
+            path, frame=frames, occupancy=self.cube(), sites=np.array(self.sites), states=np.array(self.states)
+        )
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+from scipy.sparse.csgraph import connected_components
+
+from clusters import ClusterTracker
+
+
+WIDTH, HEIGHT, RADIUS = 200, 150, 15
+
+
+def near(pos, periodic):
+    d = pos[:, None, :] - pos[None, :, :]
+    if periodic:
+        size = np.array([WIDTH, HEIGHT], dtype=np.float64)
+        d -= size * np.round(d / size)
+    return (np.hypot(d[..., 0], d[..., 1]) <= RADIUS) & ~np.eye(len(pos), dtype=bool)
+
+
+def from_scratch(pos, still, periodic):
+    # Connected components of the still agents, every cluster as a frozenset of slots
+    slots = np.flatnonzero(still)
+    _, component = connected_components(near(pos[slots], periodic), directed=False)
+    return {frozenset(slots[component == c].tolist()) for c in np.unique(component)}
+
+
+@pytest.mark.parametrize("periodic, pairs", [(True, None), (False, None), (True, "both"), (True, "one")])
+def test_cluster_tracker_matches_connected_components(periodic, pairs):
+    # Agents freeze and wake at random between samples, some wake, move and freeze again somewhere else
+    rng = np.random.default_rng(11)
+    pos = rng.uniform(0, 1, (150, 2)) * [WIDTH, HEIGHT]
+    still = np.zeros(len(pos), dtype=bool)
+    tracker = ClusterTracker(WIDTH, HEIGHT, RADIUS, periodic=periodic)
+
+    for frame in range(60):
+        flip = rng.uniform(size=len(pos)) < 0.15
+        refreeze = still & (rng.uniform(size=len(pos)) < 0.03)
+        step = rng.normal(0, 3, pos.shape)
+        pos = np.where((still & ~refreeze)[:, None], pos, np.mod(pos + step, [WIDTH, HEIGHT]))
+        still = still ^ flip
+
+        found = None
+        if pairs is not None:
+            i, j = np.nonzero(near(pos, periodic))
+            found = (i, j) if pairs == "both" else (i[i < j], j[i < j])
+
+        row = tracker.sample(frame, pos, still, found)
+        expected = from_scratch(pos, still, periodic)
+        assert {frozenset(cluster.tolist()) for cluster in tracker.clusters()} == expected
+        assert row["clusters"] == len(expected) and row["still"] == still.sum()
@@ -0,0 +1,40 @@
+import numpy as np
+import polars as pl
+
+from scenarios import STATES, occupancy_of, read_infos, read_parts
+
+
+def test_stopped_and_full_replicates_merge(tmp_path):
+    # A replicate that settled at frame 4 of 10 next to one that ran all 10 frames
+    stopped = occupancy_of("same_size", 1, np.arange(5, dtype=np.int32), np.ones((5, len(STATES)), dtype=np.int32), 4, 10)
+    full = occupancy_of("same_size", 2, np.arange(11, dtype=np.int32), np.ones((11, len(STATES)), dtype=np.int32), 4)
+    assert stopped["frame"].dtype == full["frame"].dtype == pl.Int32
+
+    paths = []
+    for k, part in enumerate([stopped, full]):
+        paths.append(tmp_path / f"{k}.parquet")
+        part.write_parquet(paths[-1])
+
+    occupancy = read_parts(paths)
+    assert occupancy.filter(pl.col("seed") == 1)["frame"].max() == 10
+    assert occupancy.group_by("seed").count()["count"].to_list() == [11 * len(STATES)] * 2
+
+
+def test_old_int64_parts_still_merge(tmp_path):
+    full = occupancy_of("same_size", 1, np.arange(3), np.ones((3, len(STATES)), dtype=np.int32), 4)
+    old = full.with_columns(pl.col("frame").cast(pl.Int64), pl.col("seed") + 1)
+    full.write_parquet(tmp_path / "a.parquet")
+    old.write_parquet(tmp_path / "b.parquet")
+
+    assert read_parts([tmp_path / "a.parquet", tmp_path / "b.parquet"]).height == 2 * 3 * len(STATES)
+
+
+def test_stopped_and_full_infos_merge(tmp_path):
+    stopped = {"scenario": "same_size", "seed": 1, "stopped_at": 4, "reason": "steady state", "majority_frame": 2}
+    full = {"scenario": "same_size", "seed": 2, "stopped_at": None, "reason": "duration", "majority_frame": None}
+    pl.DataFrame([stopped]).write_parquet(tmp_path / "a.info.parquet")
+    pl.DataFrame([full]).write_parquet(tmp_path / "b.info.parquet")
+
+    replicates = read_infos([tmp_path / "a.info.parquet", tmp_path / "b.info.parquet"])
+    assert replicates["stopped_at"].to_list() == [4, None]
+    assert replicates["reason"].to_list() == ["steady state", "duration"]
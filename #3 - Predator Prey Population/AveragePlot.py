@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 
@@ -7,20 +8,26 @@ dfs = []
 # Loop through the 10 files and read them
 for i in range(1, 11):
     # Construct the file name -> Energy free edition
-    file_name = f"Assignments/Assignment_2/EneaEnergyFreeNoFlocking/DataTest_{i}.csv"
+    file_name = f"Assignments/Assignment_2/EneaEnergyFreeNoFlocking/Populations_{i}.npz"
 
     # Construct the file name -> Energy edition
-    #file_name = f"Assignments/Assignment_2/EnergyTestData1.1/DataTest_{i}.csv"
-
-    # Read the file into a dataframe
-    df = pd.read_csv(file_name)
-    # Group by frame and type, then count occurrences
-    grouped_df = df.groupby(['frame', 'Type']).size().reset_index(name='count')
-    # Pivot the table to get counts for Fox and Rabbit in separate columns
-    pivot_df = grouped_df.pivot(index='frame', columns='Type', values='count').fillna(0)
+    #file_name = f"Assignments/Assignment_2/EnergyTestData1.1/Populations_{i}.npz"
+
+    # Foxes and rabbits per frame as counted during the run, one column per type
+    data = np.load(file_name)
+    pivot_df = pd.DataFrame(data["Type"], index=data["frame"], columns=data["Type_categories"]).astype(float)
     # Append the pivot table to the list
     dfs.append(pivot_df)
 
+# Runs that stopped early (stop_on_extinction, steady_window) have fewer frames, line them all up on the longest one.
+# A stopped run keeps the populations it ended with: a type that died out stays at 0, the other one
+# at its last count. Leaving them out instead would average the later frames over the surviving runs only
+frames = pd.Index(sorted(set().union(*(pivot_df.index for pivot_df in dfs))))
+stopped = sum(len(pivot_df) < len(frames) for pivot_df in dfs)
+dfs = [pivot_df.reindex(frames).ffill() for pivot_df in dfs]
+if stopped:
+    print(f"{stopped} of {len(dfs)} runs stopped early, padded with their final populations")
+
 # Create a figure and axis for the plot
 plt.figure(figsize=(12, 6))
 
@@ -8,17 +8,31 @@ import matplotlib.pyplot as plt
 import pandas as pd
 import os
 
+# Animal and the simulation around it are shared by the four predator-prey scripts
+from predator_prey import Animal, PredatorPrey
+
+
 @deserialize
 @dataclass
 class CompetitionConfig(Config):
-    sleeper: int = 1
     init_foxes: int = 25                        # Starting amount of foxes
     init_rabbits: int = 50                      # Starting amount of rabbitsx
 
     width: int = 800
     height: int = 800
     radius: int = 25                            # Proximity radius
+    proximity_backend: str = "violet"           # "violet" (in_proximity_accuracy, edges don't wrap), or the toroidal "grid" or "kdtree" (periodic KD-tree)
+    verlet_skin: float = 0                      # Extra reach of the cached neighbour lists (grid and kdtree), 0 rebuilds every frame
+    recycle_agents: bool = False                # Hand killed foxes and rabbits out again on reproduce() instead of new agents, see pool.py
+    batched_predation: bool = False             # Match all foxes with rabbits at once every frame, see PreyIndex in spatial.py
+    record_agents: bool = False                 # Write the per-agent rows (frame, id, x, y, angle, Type) to Agents_<i> during the run, see snapshots.py
+    snapshot_every: int = 600                   # Frames of per-agent rows in memory before they are written out as one row group
+    snapshot_format: str = "parquet"            # "parquet" or "arrow" (Arrow IPC file)
+    stop_on_extinction: bool = False            # End the run once foxes or rabbits died out, see convergence.py
+    steady_window: int = 0                      # Also end it once both populations settled over windows of this many frames, 0 never
+    steady_tolerance: float = 1.0               # Largest change of the mean population between two windows that counts as settled
     movement_speed: float = 1                   # Movement speed for agents
+    engine: str = "agents"                      # "agents" runs Foxes and Rabbits, "numpy" the whole population in PopulationEngine ("free" rules)
 
     delta_time: float = 1 / 60                  # Time step for the simulation
     image_rotation: bool = True                 # Enable image rotation for agents
@@ -28,8 +42,9 @@ class CompetitionConfig(Config):
     predation_rate: float = 0.4                 # Rate at which foxes catch rabbits per time step
     fox_reproduction_rate: float = 0.1          # Reproduction rate of foxes per caught rabbit
 
-class Foxes(Agent):
+class Foxes(Animal):
     config: CompetitionConfig
+    kind = "Fox"
 
     def on_spawn(self):
         self.move = Vector2(random.uniform(-1, 1), random.uniform(-1, 1)).normalize() * self.config.movement_speed
@@ -44,27 +59,27 @@ class Foxes(Agent):
             self.kill()
 
         # Look for rabbits in close proximity
-        rabbits_in_proximity = self.in_proximity_accuracy().filter_kind(Rabbits).first()
+        rabbits_in_proximity = self.simulation.prey_of(self)
         if rabbits_in_proximity:
             rabbit, distance = rabbits_in_proximity
 
             # Check for predation chance
             if random.random() < self.config.predation_rate:
                 rabbit.kill()
+                self.simulation.tally("eaten", "Rabbit")
 
                 # Reproduce based on predation
                 if random.random() < self.config.fox_reproduction_rate:
                     self.reproduce()
 
-        self.save_data("Type", "Fox")
-
     def add_randomness(self, vector, magnitude):
         random_perturbation = Vector2(random.uniform(-magnitude, magnitude), random.uniform(-magnitude, magnitude))
         new_vector = vector + random_perturbation
         return new_vector.normalize() * self.config.movement_speed
 
-class Rabbits(Agent):
+class Rabbits(Animal):
     config: CompetitionConfig
+    kind = "Rabbit"
 
     def on_spawn(self):
         self.move = Vector2(random.uniform(-1, 1), random.uniform(-1, 1)).normalize() * self.config.movement_speed
@@ -78,57 +93,54 @@ class Rabbits(Agent):
         if random.random() < self.config.rabbit_birth_rate * self.config.delta_time:
             self.reproduce()
 
-        self.save_data("Type", "Rabbit")
-
     def add_randomness(self, vector, magnitude):
         random_perturbation = Vector2(random.uniform(-magnitude, magnitude), random.uniform(-magnitude, magnitude))
         new_vector = vector + random_perturbation
         return new_vector.normalize() * self.config.movement_speed
     
-# Invisible agent to ensure data being saved until the final frame    
-class Sleeper(Agent):
-
-    def on_spawn(self):
-        # Place the Sleeper agent in the middle of the simulation area
-        self.pos = Vector2(self.config.width / 2, self.config.height / 2)
-    
-    def update(self):
-        # Sleeper does nothing, remains inactive
-    
-        self.save_data("Type", "Sleeper")
-
-class LotkaVolterra(Simulation):
+class LotkaVolterra(PredatorPrey):
     config: CompetitionConfig
+    model = "free"  # PopulationEngine rules for engine = "numpy"
 
 # Set up the simulation with our custom configuration
 config = CompetitionConfig(duration=60*120, fps_limit=60000)
 
+# Why and when every run ended
+runs = []
+
 # Run the simulation n times
 for i in range(1, 11):
     print(f"Running simulation {i}")
-    simulation = HeadlessSimulation(config)
-
-    simulation.batch_spawn_agents(simulation.config.init_foxes, Foxes, ["Assignments/Assignment_2/images/red-bird.png"])
-    simulation.batch_spawn_agents(simulation.config.init_rabbits, Rabbits, ["Assignments/Assignment_2/images/green-bird.png"])
-
-    # To Ensure that no DataFrame Errors appear
-    simulation.batch_spawn_agents(simulation.config.sleeper, Sleeper, ["Assignments/Assignment_2/images/invis_agent.png"])
-
-    df = simulation.run()
+    simulation = LotkaVolterra(config)
 
     # Ensure the directory exists before writing the file
     output_dir = "Assignments/Assignment_2/EneaEnergyFreeNoFlocking"
     os.makedirs(output_dir, exist_ok=True)
 
-    # Construct the filename based on the iteration number
-    csv_filename = os.path.join(output_dir, f"DataTest_{i}.csv")
+    # The per-agent rows are only written with record_agents, snapshot_every frames at a time
+    if simulation.config.record_agents:
+        simulation.record(os.path.join(output_dir, f"Agents_{i}.{simulation.config.snapshot_format}"))
+
+    if simulation.engine is None:
+        simulation.batch_spawn_agents(simulation.config.init_foxes, Foxes, ["Assignments/Assignment_2/images/red-bird.png"])
+        simulation.batch_spawn_agents(simulation.config.init_rabbits, Rabbits, ["Assignments/Assignment_2/images/green-bird.png"])
+
+    simulation.run()
+    if simulation.sink is not None:
+        simulation.sink.close()
+
+    # Foxes and rabbits per frame plus births, deaths and eaten rabbits, read by SinglePlot.py and AveragePlot.py
+    npz_filename = os.path.join(output_dir, f"Populations_{i}.npz")
+    simulation.frame_metrics.save(npz_filename)
 
-    # Write the DataFrame to CSV
-    df.snapshots.write_csv(csv_filename)
+    print(f"Simulation {i} completed and data saved to {npz_filename}")
 
-    # Optionally, read and process the data if needed
-    # df = pd.read_csv(csv_filename)
+    summary = simulation.monitor.summary()
+    runs.append({"run": i, **summary})
+    if summary["stopped_at"] is not None:
+        print(f"Simulation {i} ended early at frame {summary['stopped_at']}: {summary['reason']}")
 
-    print(f"Simulation {i} completed and data saved to {csv_filename}")
+# Runs that ended early have no rows after their stopped_at frame
+pd.DataFrame(runs).to_csv(os.path.join(output_dir, "runs.csv"), index=False)
 
 print("All simulations completed")
@@ -1,17 +1,13 @@
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 
 # Define the file name for the single dataset
-file_name = "Assignments/Assignment_2/EnergyFlocking1/DataTest_1.csv"
+file_name = "Assignments/Assignment_2/EnergyFlocking1/Populations_1.npz"
 
-# Read the file into a dataframe
-df = pd.read_csv(file_name)
-
-# Group by frame and type, then count occurrences
-grouped_df = df.groupby(['frame', 'Type']).size().reset_index(name='count')
-
-# Pivot the table to get counts for Fox and Rabbit in separate columns
-pivot_df = grouped_df.pivot(index='frame', columns='Type', values='count').fillna(0)
+# Foxes and rabbits per frame as counted during the run, one column per type
+data = np.load(file_name)
+pivot_df = pd.DataFrame(data["Type"], index=data["frame"], columns=data["Type_categories"]).astype(float)
 
 # Apply rolling mean to smooth the data
 pivot_df['Fox'] = pivot_df['Fox'].rolling(window=20, min_periods=1).mean()
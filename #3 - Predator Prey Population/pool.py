@@ -0,0 +1,92 @@
+from collections import defaultdict
+
+from vi import Agent
+
+
+# Recycling of killed agents.
+# In a population boom rabbits reproduce and get eaten every frame, and every birth builds a new
+# agent (sprite, Vector2s, a rotated image just to find a spot it is moved away from right after).
+# With a pool a killed agent is kept, and reproduce() hands it out again instead of copy(self):
+# back into the sprite groups, a fresh id, reset() to forget what it picked up in its last life,
+# on_spawn() for its own state, pos and move of the parent.
+# The proximity index gives the slot a dead agent had to the next newborn (VerletList keeps a free-list
+# of them), so a recycled agent also gets a slot back instead of growing the index.
+#
+# A killed agent can still be looked at during the frame it died in (violet keeps updating the
+# sprites it listed, the neighbour lists hold on to it), so it only becomes free at the next
+# recycle(), called once per frame by the simulation.
+# A fresh agent also draws a random heading and spot from shared.prng_move that copy() throws away
+# right after, a recycled one skips those, so runs with and without the pool differ in those draws.
+
+
+class AgentPool:
+    def __init__(self, simulation):
+        self.simulation = simulation
+
+        self.dying = []
+        self.free = defaultdict(list)
+
+        self.created = 0
+        self.reused = 0
+
+    def release(self, agent):
+        self.dying.append(agent)
+
+    def recycle(self):
+        # Everything killed up to now can be handed out again
+        for agent in self.dying:
+            self.free[type(agent)].append(agent)
+        self.dying = []
+
+    def acquire(self, parent):
+        # A dead agent of the parent's class, brought back where the parent is, or None if there is none
+        free = self.free[type(parent)]
+        if not free:
+            self.created += 1
+            return None
+
+        agent = free.pop()
+        simulation = self.simulation
+        agent.add(simulation._all, simulation._agents)
+        agent.id = simulation._agent_id()
+
+        agent.reset()
+        agent.on_spawn()
+        agent.pos.update(parent.pos)
+        agent.move.update(parent.move)
+
+        self.reused += 1
+        return agent
+
+
+class PooledAgent(Agent):
+    """Agent whose reproduce() and kill() go through simulation.pool when the simulation has one."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Attributes of a freshly built agent, anything set on it later is forgotten by reset()
+        self._fresh = set(vars(self)) | {"_fresh"}
+
+    def reset(self):
+        # Back to a fresh agent before on_spawn(): neighbour caches (_neighbours, _neighbours_frame),
+        # stuck and movement flags (_still_stuck, _moving) and whatever else was set since fall back
+        # to their class defaults, the image starts over like in Agent.__init__
+        for name in set(vars(self)) - self._fresh:
+            delattr(self, name)
+        self._image_index = 0
+        self._image_cache = None
+
+    def reproduce(self):
+        pool = getattr(self.simulation, "pool", None)
+        child = pool.acquire(self) if pool is not None else None
+        return child if child is not None else super().reproduce()
+
+    def kill(self):
+        # Killed twice in one update (starved and died of old age) only counts once
+        if not self.alive():
+            return
+        super().kill()
+
+        pool = getattr(self.simulation, "pool", None)
+        if pool is not None:
+            pool.release(self)
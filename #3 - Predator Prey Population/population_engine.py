@@ -0,0 +1,241 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from shared.spatial import PreyIndex
+
+
+# Struct-of-arrays version of the Foxes and Rabbits agents.
+# Every species lives in preallocated NumPy arrays (position, move, energy, timer, alive mask):
+# births go into free slots, deaths only clear the alive mask and free the slot, and every
+# `compact_every` frames the living are packed to the front again. One frame is a few masked
+# passes per species instead of one Python update() per animal.
+#
+# Two rule sets, like the scripts:
+# - "energy": EneaEnergy3.py, foxes starve without rabbits and reproduce on energy,
+#             rabbits have a birth rate plus a 50% chance every 10 seconds
+# - "free":   LisaEnergyFreeTry4.py, foxes catch with predation_rate and reproduce on a catch
+#             with fox_reproduction_rate, rabbits only have their birth rate
+#
+# Same rules as the per-agent path: every rule acts on the animals alive at the start of the
+# frame (an animal that dies during its update still finishes it, like after Agent.kill()),
+# newborns are first updated the frame after their birth. The differences:
+# - a fox catches the nearest free rabbit in its radius, not the first one the proximity engine lists
+# - two foxes after the same rabbit: the closer one gets it (a seeded coin on a tie), the other
+#   tries its next nearest rabbit, see PreyIndex.match()
+# - the random draws come from a NumPy generator seeded with config.seed, not from `random`
+
+MODELS = ("energy", "free")
+
+
+def _unit(vectors):
+    length = np.hypot(vectors[:, 0], vectors[:, 1])
+    return vectors / np.where(length > 0, length, 1.0)[:, None]
+
+
+def _rotate(vectors, degrees):
+    angle = np.radians(degrees)
+    cos, sin = np.cos(angle), np.sin(angle)
+    x, y = vectors[:, 0].copy(), vectors[:, 1]
+    vectors[:, 0] = x * cos - y * sin
+    vectors[:, 1] = x * sin + y * cos
+
+
+class Species:
+    """Preallocated arrays of one species, slots below `high` are in use, the alive mask says which of them live."""
+
+    def __init__(self, capacity=64, **fields):
+        # fields: extra per-animal floats and the value a newborn starts with, e.g. energy=20
+        self.defaults = fields
+        self.capacity = capacity
+        self.pos = np.zeros((capacity, 2))
+        self.move = np.zeros((capacity, 2))
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.fields = {name: np.full(capacity, value, dtype=np.float64) for name, value in fields.items()}
+
+        self.high = 0
+        self.count = 0
+        self.free = np.empty(0, dtype=np.int64)
+
+    def __getitem__(self, name):
+        return self.fields[name]
+
+    def grow(self, capacity):
+        # Double until everything fits, the arrays keep their contents
+        while self.capacity < capacity:
+            self.capacity *= 2
+        pad = self.capacity - len(self.alive)
+        self.pos = np.concatenate([self.pos, np.zeros((pad, 2))])
+        self.move = np.concatenate([self.move, np.zeros((pad, 2))])
+        self.alive = np.concatenate([self.alive, np.zeros(pad, dtype=bool)])
+        for name, values in self.fields.items():
+            self.fields[name] = np.concatenate([values, np.full(pad, self.defaults[name], dtype=np.float64)])
+
+    def spawn(self, pos, move):
+        # Newborns take the free slots first, then new ones at the end, returns their slots
+        n = len(pos)
+        reused = self.free[len(self.free) - min(n, len(self.free)):]
+        self.free = self.free[:len(self.free) - len(reused)]
+
+        fresh = np.arange(self.high, self.high + n - len(reused))
+        if self.high + len(fresh) > self.capacity:
+            self.grow(self.high + len(fresh))
+        self.high += len(fresh)
+
+        slots = np.concatenate([reused, fresh])
+        self.pos[slots] = pos
+        self.move[slots] = move
+        self.alive[slots] = True
+        for name, values in self.fields.items():
+            values[slots] = self.defaults[name]
+        self.count += n
+        return slots
+
+    def kill(self, slots):
+        slots = np.unique(slots)
+        slots = slots[self.alive[slots]]
+        self.alive[slots] = False
+        self.free = np.concatenate([self.free, slots])
+        self.count -= len(slots)
+
+    def live(self):
+        return np.flatnonzero(self.alive[:self.high])
+
+    def compact(self):
+        # Pack the living into the first slots, nothing is free afterwards
+        keep = self.live()
+        n = len(keep)
+        self.pos[:n] = self.pos[keep]
+        self.move[:n] = self.move[keep]
+        for values in self.fields.values():
+            values[:n] = values[keep]
+        self.alive[:n] = True
+        self.alive[n:self.high] = False
+        self.high = n
+        self.free = np.empty(0, dtype=np.int64)
+
+
+class PopulationEngine:
+    def __init__(self, config, area, model="energy", compact_every=60):
+        if model not in MODELS:
+            raise ValueError(f"unknown model {model!r}, choose from {MODELS}")
+
+        self.config = config
+        self.model = model
+        self.size = np.array(area, dtype=np.float64)
+        self.compact_every = compact_every
+        self.rng = np.random.default_rng(config.seed)
+        self.frame = 0
+
+        energy = config.fox_initial_energy if model == "energy" else 0.0
+        self.foxes = Species(energy=energy)
+        self.rabbits = Species(timer=0.0)
+
+        # Foxes only ever look for rabbits, the index holds nothing else
+        self.prey = PreyIndex(*area, config.radius)
+
+        # What happened during the last frame
+        self.births = {"foxes": 0, "rabbits": 0}
+        self.deaths = {"foxes": 0, "rabbits": 0}
+        self.eaten = 0
+
+    def populate(self, foxes, rabbits):
+        # Random positions and headings, like batch_spawn_agents
+        for species, n in ((self.foxes, foxes), (self.rabbits, rabbits)):
+            pos = self.rng.uniform(0, 1, size=(n, 2)) * self.size
+            move = _unit(self.rng.uniform(-1, 1, size=(n, 2))) * self.config.movement_speed
+            species.spawn(pos, move)
+        return self
+
+    def move(self, species):
+        # Agent.change_position (teleport at the edges, small random turns) followed by the move in update()
+        n = species.high
+        pos, move = species.pos[:n], species.move[:n]
+
+        x, y = pos[:, 0], pos[:, 1]
+        width, height = self.size
+        teleported = (x < 0) | (x > width) | (y < 0) | (y > height)
+        x[x < 0] = width
+        x[x > width] = 0
+        y[y < 0] = height
+        y[y > height] = 0
+
+        # -30..30 degrees after a teleport, and a 25% chance of -10..10 degrees on any frame
+        turn = np.where(teleported, self.rng.uniform(-30, 30, size=n), 0.0)
+        turn += np.where(self.rng.random(n) < 0.25, self.rng.uniform(-10, 10, size=n), 0.0)
+        _rotate(move, turn)
+        pos += move
+
+        pos += move
+        move[:] = _unit(move + self.rng.uniform(-0.1, 0.1, size=(n, 2))) * self.config.movement_speed
+
+    def hunt(self, hunters):
+        # (fox slot, rabbit slot) of every catch, one rabbit per fox and one fox per rabbit
+        prey = self.rabbits.live()
+        self.prey.rebuild(self.rabbits.pos[prey])
+        rows, found, _ = self.prey.match(self.foxes.pos[hunters], self.rng)
+        foxes, rabbits = hunters[rows], prey[found]
+
+        # A fox that misses its rabbit leaves it for the next frame
+        if self.model == "free":
+            caught = self.rng.random(len(foxes)) < self.config.predation_rate
+            foxes, rabbits = foxes[caught], rabbits[caught]
+        return foxes, rabbits
+
+    def step(self):
+        config = self.config
+        foxes, rabbits = self.foxes, self.rabbits
+
+        # Everyone alive at the start of the frame gets its update
+        hunters = foxes.live()
+        breeders = rabbits.live()
+
+        self.move(foxes)
+        self.move(rabbits)
+
+        dying = []
+        if self.model == "energy":
+            energy = foxes["energy"]
+            energy[hunters] -= config.delta_time
+            dying.append(hunters[energy[hunters] <= 0])
+
+        natural = self.rng.random(len(hunters)) < config.fox_natural_death_rate * config.delta_time
+        dying.append(hunters[natural])
+
+        hunter, eaten = self.hunt(hunters)
+        rabbits.kill(eaten)
+        self.eaten = len(eaten)
+
+        if self.model == "energy":
+            energy[hunter] += config.fox_energy_from_rabbit
+            parents = hunters[energy[hunters] > config.fox_reproduction_energy_cost]
+            energy[parents] -= config.fox_reproduction_energy_cost
+        else:
+            parents = hunter[self.rng.random(len(hunter)) < config.fox_reproduction_rate]
+
+        # Rabbits: the birth rate, plus a 50% chance every 10 seconds in the energy model
+        born = [breeders[self.rng.random(len(breeders)) < config.rabbit_birth_rate * config.delta_time]]
+        if self.model == "energy":
+            timer = rabbits["timer"]
+            timer[breeders] += config.delta_time
+            due = breeders[timer[breeders] >= 10]
+            born.append(due[self.rng.random(len(due)) < 0.5])
+            timer[due] = 0
+        born = np.concatenate(born)
+
+        before = foxes.count
+        foxes.kill(np.concatenate(dying))
+        self.deaths = {"foxes": before - foxes.count, "rabbits": len(eaten)}
+
+        # Newborns start where their parent is, heading the same way
+        foxes.spawn(foxes.pos[parents], foxes.move[parents])
+        rabbits.spawn(rabbits.pos[born], rabbits.move[born])
+        self.births = {"foxes": len(parents), "rabbits": len(born)}
+
+        self.frame += 1
+        if self.compact_every and self.frame % self.compact_every == 0:
+            foxes.compact()
+            rabbits.compact()
@@ -0,0 +1,167 @@
+import os
+import sys
+
+import numpy as np
+from vi import HeadlessSimulation
+from vi.proximity import ProximityIter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from pool import AgentPool, PooledAgent
+from population_engine import PopulationEngine
+from snapshots import SnapshotSink
+from shared.convergence import ConvergenceMonitor
+from shared.frame_metrics import CountBy, FrameMetrics, Tally
+from shared.spatial import PreyIndex, ProximityFrame, positions
+
+
+# What the four predator-prey scripts have in common, they only differ in the rules of their foxes and rabbits.
+# Animal wires an agent to its simulation: the shared proximity index, the agent pool and the birth and
+# death counters. PredatorPrey is the simulation around them: proximity backend, batched predation,
+# per-frame counters, per-agent rows, early stopping and the numpy engine for the scripts that have one.
+# A script subclasses both, its Foxes and Rabbits set kind to "Fox" and "Rabbit".
+
+
+class Animal(PooledAgent):
+    kind = None
+
+    def __init__(self, images, simulation, *args, **kwargs):
+        # Keep the simulation around, it owns the proximity index shared by all agents
+        self.simulation = simulation
+        super().__init__(images, simulation, *args, **kwargs)
+
+    def in_proximity(self, kind=None):
+        return self.simulation.in_proximity(self, kind)
+
+    def reproduce(self):
+        self.simulation.tally("births", self.kind)
+        return super().reproduce()
+
+    def kill(self):
+        if self.alive():
+            self.simulation.tally("deaths", self.kind)
+        super().kill()
+
+    def _collect_replay_data(self):
+        # One row per agent per frame adds up to millions of rows, violet doesn't keep them,
+        # they only go to the simulation's sink when it has one
+        if self.simulation.sink is not None:
+            self.simulation.sink.add(self)
+
+
+class PredatorPrey(HeadlessSimulation):
+    # PopulationEngine rules ("energy" or "free") used with config.engine = "numpy", None for scripts without the engine
+    model = None
+
+    def __init__(self, config):
+        super().__init__(config)
+        width, height = self.config.window.as_tuple()
+        backend = self.config.proximity_backend
+
+        # "violet" keeps using the agents' own in_proximity_accuracy()
+        self.proximity = None if backend == "violet" else ProximityFrame(
+            self._agents, width, height, self.config.radius, backend=backend, skin=self.config.verlet_skin
+        )
+
+        # With the numpy engine no agents are spawned, the engine keeps the whole population in arrays
+        self.engine = None
+        if self.model is not None and self.config.engine == "numpy":
+            self.engine = PopulationEngine(self.config, (width, height), model=self.model)
+            self.engine.populate(self.config.init_foxes, self.config.init_rabbits)
+
+        # Foxes look for rabbits in an index of the rabbits only, see prey_of()
+        self.prey = PreyIndex(width, height, self.config.radius) if self.config.batched_predation else None
+        self.rng = np.random.default_rng(self.config.seed)
+        self.catches = {}
+        self.matched = None
+
+        # Foxes and rabbits per frame and what happened to them, instead of grouping a row per agent per frame.
+        # The numpy engine has no agents to count, its numbers are added up as they are
+        kinds = ["Fox", "Rabbit"]
+        population = CountBy("Type", lambda agent: agent.kind, kinds) if self.engine is None else Tally("Type", kinds)
+        self.frame_metrics = FrameMetrics(
+            population,
+            Tally("births", ["Fox", "Rabbit"]),
+            Tally("deaths", ["Fox", "Rabbit"]),
+            Tally("eaten", ["Rabbit"]),
+        )
+
+        # Per-agent rows go straight to a file, see record()
+        self.sink = None
+
+        # Killed agents wait in the pool for the next reproduce()
+        self.pool = AgentPool(self) if self.config.recycle_agents else None
+
+        # Ends the run once nothing interesting can happen anymore, why and when is kept in monitor.summary()
+        self.monitor = ConvergenceMonitor(
+            ["foxes", "rabbits"], self.config.steady_window, self.config.steady_tolerance,
+            absorbing=["foxes", "rabbits"] if self.config.stop_on_extinction else [],
+        )
+
+    def in_proximity(self, agent, kind=None):
+        if self.proximity is None:
+            nearby = agent.in_proximity_accuracy()
+        else:
+            nearby = ProximityIter(self.proximity.in_proximity(agent, self.shared.counter))
+
+        return nearby.filter_kind(kind) if kind is not None else nearby
+
+    def prey_of(self, fox):
+        # (rabbit, distance) the fox catches this frame or None, like in_proximity(Rabbits).first()
+        if self.prey is None:
+            return self.in_proximity(fox).filter(lambda found: found[0].kind == "Rabbit").first()
+
+        # All foxes at once on the first call of a frame: one rabbit per fox and one fox per rabbit,
+        # the nearest free rabbit for every fox, so the order the foxes are updated in doesn't decide who eats
+        if self.matched != self.shared.counter:
+            self.matched = self.shared.counter
+            foxes = [agent for agent in self._agents if agent.kind == "Fox"]
+            rabbits = [agent for agent in self._agents if agent.kind == "Rabbit"]
+
+            self.prey.rebuild(positions(rabbits))
+            rows, found, dist = self.prey.match(positions(foxes), self.rng)
+            self.catches = {
+                foxes[i].id: (rabbits[j], d) for i, j, d in zip(rows.tolist(), found.tolist(), dist.tolist())
+            }
+        return self.catches.get(fox.id)
+
+    def before_update(self):
+        super().before_update()
+
+        if self.pool is not None:
+            self.pool.recycle()
+
+        if self.engine is not None:
+            self.engine.step()
+
+    def record(self, path):
+        # Write the per-agent rows to path while the simulation runs, close the sink after the run
+        self.sink = SnapshotSink(
+            path, ["Fox", "Rabbit"], self.config.snapshot_every, self.config.image_rotation, self.config.snapshot_format
+        )
+        return self
+
+    def tally(self, event, kind, n=1):
+        self.frame_metrics.reducers[event].add(kind, n)
+
+    def after_update(self):
+        if self.engine is not None:
+            # What the engine did this frame
+            for kind, species in (("Fox", "foxes"), ("Rabbit", "rabbits")):
+                self.tally("Type", kind, getattr(self.engine, species).count)
+                self.tally("births", kind, self.engine.births[species])
+                self.tally("deaths", kind, self.engine.deaths[species])
+            self.tally("eaten", "Rabbit", self.engine.eaten)
+
+        self.frame_metrics.update(self.shared.counter, self._agents)
+        foxes, rabbits = self.frame_metrics.reducers["Type"].array()[-1].tolist()
+
+        # Runs last the whole duration unless stop_on_extinction or steady_window ask for an early end
+        if self.config.stop_on_extinction or self.config.steady_window:
+            if self.monitor.update(self.shared.counter, [foxes, rabbits]):
+                self.stop()
+
+        if self.sink is not None:
+            self.sink.end_frame()
+
+        super().after_update()
@@ -0,0 +1,112 @@
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+# Per-agent rows written out while the simulation runs.
+# violet keeps every row in .snapshots until the run ends, so memory grows with frames x agents
+# and the scripts then wrote it all out as CSV. The sink takes the same rows (frame, id, x, y,
+# image_index, angle, Type) and writes them every `every` frames as one Parquet row group or one
+# Arrow IPC record batch, so at most `every` frames of rows are ever in memory.
+# Type is dictionary encoded, positions are int16 (violet rounds them to pixels anyway).
+# Both formats can be read lazily and a frame range at a time:
+#   pl.scan_parquet("Agents_1.parquet").filter(pl.col("frame") < 600).collect()
+#   pl.scan_ipc("Agents_1.arrow")
+#   pd.read_parquet("Agents_1.parquet", filters=[("frame", "<", 600)])
+
+FORMATS = ("parquet", "arrow")
+
+
+class SnapshotSink:
+    def __init__(self, path, kinds, every=600, rotation=True, format="parquet"):
+        if format not in FORMATS:
+            raise ValueError(f"unknown snapshot format {format!r}, choose from {FORMATS}")
+
+        self.path = path
+        self.every = every
+        self.rotation = rotation
+        self.format = format
+
+        # Type is stored as a code into kinds
+        self.kinds = list(kinds)
+        self.codes = {kind: code for code, kind in enumerate(self.kinds)}
+
+        fields = [
+            ("frame", pa.int32()),
+            ("id", pa.int32()),
+            ("x", pa.int16()),
+            ("y", pa.int16()),
+            ("image_index", pa.int8()),
+        ]
+        if rotation:
+            fields.append(("angle", pa.int16()))
+        fields.append(("Type", pa.dictionary(pa.int8(), pa.string())))
+        self.schema = pa.schema(fields)
+
+        self.columns = {name: [] for name in self.schema.names}
+        self.writer = None
+        self.pending = 0
+
+        self.rows = 0
+        self.groups = 0
+
+    def add(self, agent):
+        # The row violet's Agent._collect_replay_data() would add, plus the agent's kind
+        x, y = agent.center
+        columns = self.columns
+        columns["frame"].append(agent.shared.counter)
+        columns["id"].append(agent.id)
+        columns["x"].append(x)
+        columns["y"].append(y)
+        columns["image_index"].append(agent._image_index)
+        if self.rotation:
+            columns["angle"].append(round(agent.move.angle_to((0, -1))))
+        columns["Type"].append(self.codes[agent.kind])
+
+    def end_frame(self):
+        self.pending += 1
+        if self.pending >= self.every:
+            self.flush()
+
+    def flush(self):
+        # Everything since the last flush as one row group / record batch
+        self.pending = 0
+        if not self.columns["frame"]:
+            return
+
+        arrays = []
+        for field in self.schema:
+            values = self.columns[field.name]
+            if field.name == "Type":
+                arrays.append(pa.DictionaryArray.from_arrays(pa.array(values, pa.int8()), pa.array(self.kinds)))
+            else:
+                arrays.append(pa.array(values, field.type))
+        table = pa.Table.from_arrays(arrays, schema=self.schema)
+
+        if self.writer is None:
+            if self.format == "parquet":
+                self.writer = pq.ParquetWriter(self.path, self.schema, compression="zstd")
+            else:
+                self.writer = pa.ipc.new_file(self.path, self.schema)
+        if self.format == "parquet":
+            # One row group per flush, however many rows it has
+            self.writer.write_table(table, row_group_size=len(table))
+        else:
+            self.writer.write_table(table)
+
+        self.rows += len(table)
+        self.groups += 1
+        self.columns = {name: [] for name in self.schema.names}
+
+    def close(self):
+        self.flush()
+        if self.writer is None:
+            # Not a single row, still leave a readable file behind
+            table = self.schema.empty_table()
+            if self.format == "parquet":
+                pq.write_table(table, self.path)
+            else:
+                with pa.ipc.new_file(self.path, self.schema) as writer:
+                    writer.write_table(table)
+            return
+        self.writer.close()
+        self.writer = None
@@ -0,0 +1,3 @@
+# Code used by more than one assignment: the toroidal spatial indexes (spatial.py), the per-frame
+# counters (frame_metrics.py) and the early-stop monitor (convergence.py).
+# The scripts put the folder above their own on sys.path and import it as `shared.<module>`.
@@ -0,0 +1,71 @@
+import numpy as np
+
+
+# Ends a run once nothing interesting can happen anymore.
+# The monitor is fed a few observables every frame (state shares, population sizes, ...) and
+# reports a stop when either
+# - an absorbing observable hit zero (a species died out, it can't come back), or
+# - every observable settled: the means of the last two windows of `window` frames differ by
+#   no more than `tolerance`, for `patience` checks in a row.
+# The reason and the frame are kept, so a run that ended early can be told from one that didn't.
+
+
+class ConvergenceMonitor:
+    def __init__(self, names, window=600, tolerance=0.01, patience=3, absorbing=(), check_every=None):
+        self.names = list(names)
+        # window=0 only stops on absorption
+        self.window = window
+        self.tolerance = tolerance
+        self.patience = patience
+        self.absorbing = [self.names.index(name) for name in absorbing]
+        self.check_every = check_every or max(1, window // 10)
+
+        # Last two windows of every observable, a ring buffer indexed by the number of frames seen
+        self.history = np.zeros((2 * window, len(self.names)))
+        self.seen = 0
+        self.settled = 0
+
+        self.reason = None
+        self.frame = None
+        self.last = None
+
+    @property
+    def stopped(self):
+        return self.reason is not None
+
+    def update(self, frame, values):
+        # values in the order of names, returns True once the run should stop
+        if self.stopped:
+            return True
+
+        values = np.asarray(values, dtype=np.float64)
+        self.last = values
+
+        for k in self.absorbing:
+            if values[k] == 0:
+                return self.stop(frame, f"{self.names[k]} extinct")
+
+        if not self.window:
+            return False
+
+        self.history[self.seen % len(self.history)] = values
+        self.seen += 1
+        if self.seen < len(self.history) or self.seen % self.check_every:
+            return False
+
+        # Oldest window first, then the most recent one
+        ordered = np.roll(self.history, -(self.seen % len(self.history)), axis=0)
+        change = np.abs(ordered[self.window:].mean(axis=0) - ordered[:self.window].mean(axis=0))
+        self.settled = self.settled + 1 if (change <= self.tolerance).all() else 0
+
+        if self.settled >= self.patience:
+            return self.stop(frame, "steady state")
+        return False
+
+    def stop(self, frame, reason):
+        self.frame = frame
+        self.reason = reason
+        return True
+
+    def summary(self):
+        return {"stopped_at": self.frame, "reason": self.reason or "duration"}
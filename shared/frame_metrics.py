@@ -0,0 +1,127 @@
+import numpy as np
+import polars as pl
+
+
+# Per-frame counters that are updated while the simulation runs.
+# violet keeps one row per agent per frame in .snapshots, which the scripts only ever
+# group by frame after the run. A reducer turns the agents of a frame into a few numbers
+# straight away, so memory grows with frames x categories instead of frames x agents.
+
+
+class _Rows:
+    # Growable (frames, columns) int32 array, doubles its capacity when full
+
+    def __init__(self, columns=0):
+        self.data = np.zeros((64, columns), dtype=np.int32)
+        self.size = 0
+
+    def append(self, row):
+        if len(row) > self.data.shape[1]:
+            # A category showed up for the first time, earlier frames had none of it
+            self.data = np.pad(self.data, ((0, 0), (0, len(row) - self.data.shape[1])))
+        if self.size == len(self.data):
+            self.data = np.concatenate([self.data, np.zeros_like(self.data)])
+
+        self.data[self.size, :len(row)] = row
+        self.size += 1
+
+    def array(self):
+        return self.data[:self.size]
+
+
+class CountBy:
+    """Number of agents per value of key(agent), every frame."""
+
+    def __init__(self, name, key, categories=()):
+        self.name = name
+        self.key = key
+
+        # Categories not listed up front get a new column the first time they are seen
+        self.categories = list(categories)
+        self.columns = {category: column for column, category in enumerate(self.categories)}
+        self.rows = _Rows(len(self.categories))
+
+    def column(self, category):
+        if category not in self.columns:
+            self.columns[category] = len(self.categories)
+            self.categories.append(category)
+        return self.columns[category]
+
+    def update(self, agents):
+        columns = [self.column(self.key(agent)) for agent in agents]
+        self.rows.append(np.bincount(columns, minlength=len(self.categories)))
+
+    def array(self):
+        return self.rows.array()
+
+
+class Tally:
+    """Numbers added up while a frame runs (births, deaths, ...), one row per frame."""
+
+    def __init__(self, name, categories):
+        self.name = name
+        self.categories = list(categories)
+        self.columns = {category: column for column, category in enumerate(self.categories)}
+        self.pending = np.zeros(len(self.categories), dtype=np.int32)
+        self.rows = _Rows(len(self.categories))
+
+    def add(self, category, n=1):
+        self.pending[self.columns[category]] += n
+
+    def update(self, agents):
+        # The agents aren't looked at, the row is whatever was added since the last frame
+        self.rows.append(self.pending)
+        self.pending = np.zeros_like(self.pending)
+
+    def array(self):
+        return self.rows.array()
+
+
+class FrameMetrics:
+    """The registered reducers, fed with all agents once per frame."""
+
+    def __init__(self, *reducers):
+        self.reducers = {}
+        self.frames = _Rows(1)
+        for reducer in reducers:
+            self.register(reducer)
+
+    def register(self, reducer):
+        if self.frames.size:
+            raise ValueError(f"register {reducer.name!r} before the first frame")
+        self.reducers[reducer.name] = reducer
+        return self
+
+    def update(self, frame, agents):
+        agents = list(agents)
+        self.frames.append([frame])
+        for reducer in self.reducers.values():
+            reducer.update(agents)
+
+    def frame(self):
+        return self.frames.array()[:, 0]
+
+    def counts(self, name):
+        # (frames, categories) array plus the category of every column
+        reducer = self.reducers[name]
+        return reducer.array(), reducer.categories
+
+    def long(self, name, zeros=False):
+        # Same layout as snapshots.group_by(["frame", name]).agg(pl.count("id").alias("agents")),
+        # without zeros a category only has rows for the frames it occurs in, just like the group_by
+        counts, categories = self.counts(name)
+        frames, columns = np.nonzero(counts if not zeros else np.ones_like(counts))
+
+        return pl.DataFrame({
+            "frame": self.frame()[frames],
+            name: pl.Series([categories[column] for column in columns.tolist()]),
+            "agents": counts[frames, columns],
+        })
+
+    def save(self, path):
+        # One compressed .npz: the frame numbers, the counts of every reducer and their categories
+        arrays = {"frame": self.frame()}
+        for name, reducer in self.reducers.items():
+            arrays[name] = reducer.array()
+            arrays[f"{name}_categories"] = np.array(reducer.categories)
+        np.savez_compressed(path, **arrays)
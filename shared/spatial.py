@@ -0,0 +1,628 @@
+import heapq
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+# Neighbour search for agents living on a torus.
+# there_is_no_escape() teleports agents to the other side of the window,
+# so an agent at the left edge is a neighbour of one at the right edge.
+# Everything here works on an (N, 2) array of positions and is rebuilt once per frame.
+
+
+def positions(agents):
+    # (N, 2) array of the agents' pos
+    return np.array([(agent.pos.x, agent.pos.y) for agent in agents], dtype=np.float64).reshape(-1, 2)
+
+
+def wrapped(offset, width, height):
+    # Shortest way round the torus for one pygame Vector2 offset, changed in place.
+    # The toroidal backends report neighbours across the screen edge, this turns their raw offset around
+    if abs(offset.x) > width / 2:
+        offset.x -= width if offset.x > 0 else -width
+    if abs(offset.y) > height / 2:
+        offset.y -= height if offset.y > 0 else -height
+    return offset
+
+
+def _ragged_arange(counts):
+    # np.concatenate([np.arange(c) for c in counts]) without the Python loop
+    total = int(counts.sum())
+    firsts = np.cumsum(counts) - counts
+    return np.arange(total) - np.repeat(firsts, counts)
+
+
+class _TorusIndex:
+    def __init__(self, width, height, radius):
+        self.size = np.array([width, height], dtype=np.float64)
+        self.radius = radius
+
+    def _wrap(self, pos):
+        # Map positions into [0, width) x [0, height), there_is_no_escape() allows both edges
+        pos = np.mod(np.asarray(pos, dtype=np.float64).reshape(-1, 2), self.size)
+        return np.where(pos >= self.size, 0.0, pos)
+
+    def delta(self, a, b):
+        # Shortest vector from b to a on the torus
+        d = a - b
+        d -= self.size * np.round(d / self.size)
+        return d
+
+    def distance(self, a, b):
+        d = self.delta(a, b)
+        return np.hypot(d[:, 0], d[:, 1])
+
+
+class ToroidalGrid(_TorusIndex):
+    """Uniform cell list with cells at least one radius wide and wrap-around neighbour cells."""
+
+    def __init__(self, width, height, radius):
+        super().__init__(width, height, radius)
+
+        self.nx = max(1, int(width // radius))
+        self.ny = max(1, int(height // radius))
+        self.cell_size = self.size / (self.nx, self.ny)
+
+        # With fewer than three cells along an axis, -1 and +1 wrap onto the same cell,
+        # so the offsets are deduplicated to avoid reporting a pair twice
+        xs = sorted({dx % self.nx for dx in (-1, 0, 1)})
+        ys = sorted({dy % self.ny for dy in (-1, 0, 1)})
+        self.offsets = [(dx, dy) for dx in xs for dy in ys]
+
+        self.rebuild(np.empty((0, 2)))
+
+    def rebuild(self, pos):
+        # Counting sort of the agents by cell: count per cell, prefix sum for the start of every cell,
+        # then a stable sort on a small integer key (numpy uses radix sort for 16 bit keys)
+        self.pos = self._wrap(pos)
+        self.cx, self.cy = self._cells(self.pos)
+
+        n_cells = self.nx * self.ny
+        key = self.cy * self.nx + self.cx
+        key = key.astype(np.uint16 if n_cells <= np.iinfo(np.uint16).max else np.uint32)
+
+        self.count = np.bincount(key, minlength=n_cells)
+        self.start = np.cumsum(self.count) - self.count
+        self.order = np.argsort(key, kind="stable")
+
+    def _cells(self, pos):
+        cells = (pos // self.cell_size).astype(np.int64)
+        # A position of exactly width/height belongs to the last cell
+        cx = np.minimum(cells[:, 0], self.nx - 1)
+        cy = np.minimum(cells[:, 1], self.ny - 1)
+        return cx, cy
+
+    def _check_radius(self, radius):
+        if radius > self.cell_size.min():
+            raise ValueError(f"radius {radius} is larger than the grid cells {self.cell_size.min():.1f}, rebuild the grid")
+
+    def _candidates(self, cx, cy):
+        # For every offset: (query index, agent index) of all agents in the neighbouring cell
+        for dx, dy in self.offsets:
+            cell = ((cy + dy) % self.ny) * self.nx + (cx + dx) % self.nx
+            counts = self.count[cell]
+            q = np.repeat(np.arange(len(cell)), counts)
+            j = self.order[np.repeat(self.start[cell], counts) + _ragged_arange(counts)]
+            yield q, j
+
+    def pairs(self, radius=None):
+        # All directed pairs (i, j, distance) within the radius, i != j
+        radius = self.radius if radius is None else radius
+        self._check_radius(radius)
+
+        found_i, found_j, found_d = [], [], []
+        for i, j in self._candidates(self.cx, self.cy):
+            keep = i != j
+            i, j = i[keep], j[keep]
+            dist = self.distance(self.pos[i], self.pos[j])
+            keep = dist <= radius
+            found_i.append(i[keep])
+            found_j.append(j[keep])
+            found_d.append(dist[keep])
+
+        if not found_i:
+            return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0)
+        return np.concatenate(found_i), np.concatenate(found_j), np.concatenate(found_d)
+
+    def counts(self, radius=None):
+        # Number of neighbours within the radius of every agent, summed per offset without keeping the pairs
+        radius = self.radius if radius is None else radius
+        self._check_radius(radius)
+
+        counts = np.zeros(len(self.pos), dtype=np.int64)
+        for i, j in self._candidates(self.cx, self.cy):
+            keep = (i != j) & (self.distance(self.pos[i], self.pos[j]) <= radius)
+            counts += np.bincount(i[keep], minlength=len(self.pos))
+        return counts
+
+    def query(self, point, radius=None):
+        # Indices and distances of all agents within the radius of a single point
+        radius = self.radius if radius is None else radius
+        self._check_radius(radius)
+
+        point = self._wrap(point)
+        cx, cy = self._cells(point)
+        j = np.concatenate([j for _, j in self._candidates(cx, cy)])
+        dist = self.distance(self.pos[j], point)
+        keep = dist <= radius
+        return j[keep], dist[keep]
+
+
+class PeriodicKDTree(_TorusIndex):
+    """scipy's cKDTree with a periodic box, better than the grid when agents pile up in a few cells."""
+
+    def __init__(self, width, height, radius):
+        super().__init__(width, height, radius)
+        self.rebuild(np.empty((0, 2)))
+
+    def rebuild(self, pos):
+        self.pos = self._wrap(pos)
+        self.tree = cKDTree(self.pos, boxsize=self.size)
+
+    def pairs(self, radius=None):
+        # All directed pairs (i, j, distance) within the radius in a single tree query
+        radius = self.radius if radius is None else radius
+
+        pairs = self.tree.query_pairs(radius, output_type="ndarray")
+        i = np.concatenate([pairs[:, 0], pairs[:, 1]]).astype(np.int64)
+        j = np.concatenate([pairs[:, 1], pairs[:, 0]]).astype(np.int64)
+        return i, j, self.distance(self.pos[i], self.pos[j])
+
+    def counts(self, radius=None):
+        # Number of neighbours within the radius of every agent, the tree counts them without listing any,
+        # so a crowded site with dozens of neighbours per agent costs no more memory than an empty one
+        radius = self.radius if radius is None else radius
+        if not len(self.pos):
+            return np.zeros(0, dtype=np.int64)
+
+        # Every agent finds itself at distance 0
+        return self.tree.query_ball_point(self.pos, radius, return_length=True).astype(np.int64) - 1
+
+    def query(self, point, radius=None):
+        # Indices and distances of all agents within the radius of a single point
+        radius = self.radius if radius is None else radius
+
+        point = self._wrap(point)
+        j = np.asarray(self.tree.query_ball_point(point[0], radius), dtype=np.int64)
+        return j, self.distance(self.pos[j], point)
+
+
+BACKENDS = {
+    "grid": ToroidalGrid,
+    "kdtree": PeriodicKDTree,
+}
+
+
+def make_index(backend, width, height, radius):
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown proximity backend {backend!r}, choose from {sorted(BACKENDS)}")
+    return BACKENDS[backend](width, height, radius)
+
+
+class PreyIndex(_TorusIndex):
+    """Index of one kind only (the prey), hunters of another kind are matched against it in one batch."""
+
+    def __init__(self, width, height, radius, k=8):
+        super().__init__(width, height, radius)
+        # Nearest prey looked at per hunter, a hunter whose k nearest are all taken goes without
+        self.k = k
+        self.rebuild(np.empty((0, 2)))
+
+    def rebuild(self, pos):
+        self.pos = self._wrap(pos)
+        self.tree = cKDTree(self.pos, boxsize=self.size)
+
+    def match(self, hunters, rng=None):
+        # (hunter rows, prey rows, distances) with at most one prey per hunter and one hunter per prey.
+        # Every hunter goes for its nearest prey that's still free, a prey wanted by several hunters goes
+        # to the closest one, equal distances by a random order of the hunters drawn from rng (row order without)
+        hunters = self._wrap(hunters)
+        empty = np.empty(0, dtype=np.int64)
+        if not len(hunters) or not len(self.pos):
+            return empty, empty, np.empty(0)
+
+        k = min(self.k, len(self.pos))
+        dist, near = self.tree.query(hunters, k=k, distance_upper_bound=self.radius)
+        dist, near = dist.reshape(len(hunters), k), near.reshape(len(hunters), k)
+
+        rank = rng.permutation(len(hunters)) if rng is not None else np.arange(len(hunters))
+        taken = np.zeros(len(self.pos) + 1, dtype=bool)
+        # Missing neighbours come back as row len(self.pos), it counts as taken
+        taken[-1] = True
+        column = np.zeros(len(hunters), dtype=np.int64)
+        found = []
+
+        active = np.arange(len(hunters))
+        while len(active):
+            # Skip past the prey taken in earlier rounds
+            while True:
+                blocked = taken[near[active, np.minimum(column[active], k - 1)]] & (column[active] < k)
+                if not blocked.any():
+                    break
+                column[active[blocked]] += 1
+            active = active[column[active] < k]
+            if not len(active):
+                break
+
+            prey = near[active, column[active]]
+            order = np.lexsort((rank[active], dist[active, column[active]], prey))
+            _, first = np.unique(prey[order], return_index=True)
+            won = active[order[first]]
+
+            found.append(won)
+            taken[near[won, column[won]]] = True
+            active = np.setdiff1d(active, won)
+
+        won = np.sort(np.concatenate(found)) if found else empty
+        return won, near[won, column[won]].astype(np.int64), dist[won, column[won]]
+
+
+class DormantCounts(_TorusIndex):
+    """Neighbour counts where agents that stopped moving keep their index entries and counts between frames."""
+
+    def __init__(self, width, height, radius, periodic=True, max_stale=0.25):
+        super().__init__(width, height, radius)
+        # periodic=False counts without wrapping around the edges, like violet
+        self.periodic = periodic
+        # Largest share of pending plus tombstoned agents, relative to the tree, before the tree is rebuilt
+        self.max_stale = max_stale
+
+        # Per slot: frozen or not, and the number of frozen neighbours of every frozen agent
+        self.frozen = np.zeros(0, dtype=bool)
+        self.frozen_counts = np.zeros(0, dtype=np.int64)
+
+        # The frozen agents live in an append-only tree plus a short list of agents that froze since it was built.
+        # Agents that wake up stay in the tree as tombstones (live False) until the next rebuild, row -> slot
+        self.tree = None
+        self.slots = np.empty(0, dtype=np.int64)
+        self.live = np.zeros(0, dtype=bool)
+        self.rows = np.empty(0, dtype=np.int64)
+        self.pending = np.empty(0, dtype=np.int64)
+
+        self.frames = 0
+        self.rebuilds = 0
+
+    def _tree(self, pos):
+        if self.periodic:
+            return cKDTree(self._wrap(pos), boxsize=self.size)
+        return cKDTree(pos)
+
+    def _reset(self, count):
+        self.frozen = np.zeros(count, dtype=bool)
+        self.frozen_counts = np.zeros(count, dtype=np.int64)
+        self.tree = None
+        self.slots = np.empty(0, dtype=np.int64)
+        self.live = np.zeros(0, dtype=bool)
+        self.rows = np.full(count, -1, dtype=np.int64)
+        self.pending = np.empty(0, dtype=np.int64)
+
+    def _frozen_pairs(self, tree, pos):
+        # (i, slot) for every tree.data[i] within the radius of a frozen agent, tombstones left out
+        found_i, found_slot = [], []
+        if self.tree is not None:
+            pairs = tree.sparse_distance_matrix(self.tree, self.radius, output_type="ndarray")
+            keep = self.live[pairs["j"]]
+            found_i.append(pairs["i"][keep])
+            found_slot.append(self.slots[pairs["j"][keep]])
+        if len(self.pending):
+            pairs = tree.sparse_distance_matrix(self._tree(pos[self.pending]), self.radius, output_type="ndarray")
+            found_i.append(pairs["i"])
+            found_slot.append(self.pending[pairs["j"]])
+        if not found_i:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        return np.concatenate(found_i).astype(np.int64), np.concatenate(found_slot).astype(np.int64)
+
+    def counts(self, pos, frozen):
+        # Neighbours within the radius of all agents, pos and the frozen mask indexed by slot.
+        # Slots have to stay the same between frames, the agents in frozen must not have moved since they froze
+        # and those that woke up since the last call must still be where they froze, they move after this call
+        self.frames += 1
+        if len(frozen) != len(self.frozen):
+            # New population, start over
+            self._reset(len(frozen))
+
+        if (frozen != self.frozen).any():
+            self.refreeze(pos, frozen)
+
+        # Frozen agents start from what they already know about each other, only moving agents get searched
+        counts = self.frozen_counts.copy()
+        moving = np.flatnonzero(~frozen)
+        if not len(moving):
+            return counts
+
+        tree = self._tree(pos[moving])
+        counts[moving] = tree.query_ball_point(tree.data, self.radius, return_length=True) - 1
+
+        # Moving next to frozen, every pair counts for both of them
+        i, slot = self._frozen_pairs(tree, pos)
+        counts += np.bincount(moving[i], minlength=len(counts))
+        counts += np.bincount(slot, minlength=len(counts))
+        return counts
+
+    def refreeze(self, pos, frozen):
+        # Bring the frozen set up to date without rebuilding its tree, only the agents that changed get searched
+        woken = np.flatnonzero(self.frozen & ~frozen)
+        new = np.flatnonzero(frozen & ~self.frozen)
+
+        # Woken agents take themselves out of their frozen neighbours' counts and leave a tombstone behind
+        if len(woken):
+            i, others = self._frozen_pairs(self._tree(pos[woken]), pos)
+            others = others[others != woken[i]]
+            self.frozen_counts -= np.bincount(others, minlength=len(frozen))
+            self.frozen_counts[woken] = 0
+
+            in_tree = woken[self.rows[woken] >= 0]
+            self.live[self.rows[in_tree]] = False
+            self.rows[in_tree] = -1
+            self.pending = self.pending[~np.isin(self.pending, woken)]
+
+        # Newly frozen agents count their frozen neighbours, new ones included, and add themselves to the older ones
+        self.frozen = frozen.copy()
+        if len(new):
+            self.pending = np.concatenate([self.pending, new])
+            i, others = self._frozen_pairs(self._tree(pos[new]), pos)
+            keep = others != new[i]
+            i, others = i[keep], others[keep]
+            self.frozen_counts[new] = np.bincount(i, minlength=len(new))
+
+            is_new = np.zeros(len(frozen), dtype=bool)
+            is_new[new] = True
+            self.frozen_counts += np.bincount(others[~is_new[others]], minlength=len(frozen))
+
+        # Rebuild once the pending list and the tombstones make up too much of the tree
+        stale = len(self.pending) + int((~self.live).sum())
+        if stale > self.max_stale * max(int(self.live.sum()), 64):
+            self.rebuild(pos)
+
+    def rebuild(self, pos):
+        # Fresh tree of all frozen agents, the counts stay as they are
+        self.rebuilds += 1
+        self.slots = np.flatnonzero(self.frozen)
+        self.live = np.ones(len(self.slots), dtype=bool)
+        self.rows = np.full(len(self.frozen), -1, dtype=np.int64)
+        self.rows[self.slots] = np.arange(len(self.slots))
+        self.pending = np.empty(0, dtype=np.int64)
+        self.tree = self._tree(pos[self.slots]) if len(self.slots) else None
+
+
+class VerletList:
+    """Pairs within radius + skin, cached across frames while no agent has moved more than half the skin."""
+
+    def __init__(self, index, radius, skin, max_churn=0.25):
+        # The index has to be built for radius + skin, the exact radius check runs on the cached pairs
+        self.index = index
+        self.radius = radius
+        self.skin = skin
+
+        # Rebuild once births plus deaths since the last rebuild exceed this share of the population
+        self.max_churn = max_churn
+
+        self.members = []
+        self.slots = {}
+        self.ids = []
+        self.anchor = np.empty((0, 2))
+        self.built = 0
+        self.ci = self.cj = np.empty(0, dtype=np.int64)
+
+        # Slots of dead agents go on a free-list (a heap, lowest slot first) and are handed to newborns,
+        # slots given out since the last rebuild aren't at their index position anymore and are searched separately
+        self.alive = np.zeros(0, dtype=bool)
+        self.added = np.zeros(0, dtype=bool)
+        self.free = []
+        self.churn = 0
+
+        self.frames = 0
+        self.rebuilds = 0
+
+    def update(self, agents, pos):
+        # Returns the directed pairs (slot i, slot j, distance) within the radius,
+        # slots index self.members which keeps dead agents until their slot is given to a newborn
+        self.frames += 1
+
+        slot = np.array([self.slots.get(agent.id, -1) for agent in agents], dtype=np.int64)
+        known = slot >= 0
+        born = np.flatnonzero(~known)
+
+        alive = np.zeros(len(self.members), dtype=bool)
+        alive[slot[known]] = True
+        died = np.flatnonzero(self.alive & ~alive)
+        for dead in died.tolist():
+            heapq.heappush(self.free, dead)
+        self.churn += len(born) + len(died)
+        self.alive = alive
+
+        moved = self.index.distance(pos[known], self.anchor[slot[known]])
+
+        if not self.built or moved.max(initial=0.0) > self.skin / 2 or self.churn > self.max_churn * self.built:
+            self.rebuild(agents, pos)
+            slot = np.arange(len(agents))
+        elif len(born):
+            slot[born] = self.add(agents, pos, born)
+
+        alive = self.alive
+        current = self.anchor.copy()
+        current[slot] = pos
+
+        # Exact distance filter on the cached candidates, dead agents drop out here
+        keep = alive[self.ci] & alive[self.cj]
+        i, j = self.ci[keep], self.cj[keep]
+        dist = self.index.distance(current[i], current[j])
+        keep = dist <= self.radius
+        return i[keep], j[keep], dist[keep]
+
+    def rebuild(self, agents, pos):
+        self.rebuilds += 1
+        self.members = list(agents)
+        self.slots = {agent.id: slot for slot, agent in enumerate(self.members)}
+        self.ids = [agent.id for agent in self.members]
+        self.anchor = pos.copy()
+        self.built = len(self.members)
+        self.alive = np.ones(self.built, dtype=bool)
+        self.added = np.zeros(self.built, dtype=bool)
+        self.free = []
+        self.churn = 0
+
+        self.index.rebuild(pos)
+        self.ci, self.cj, _ = self.index.pairs()
+
+    def add(self, agents, pos, born):
+        # Newborns take the slots of dead agents first, then fresh slots at the end,
+        # their candidates are found without a full rebuild
+        free = np.array([heapq.heappop(self.free) for _ in range(min(len(born), len(self.free)))], dtype=np.int64)
+        first = len(self.members)
+        slots = np.concatenate([free, np.arange(first, first + len(born) - len(free))]).astype(np.int64)
+
+        # Cached pairs of the dead agents whose slots are taken
+        if len(free):
+            gone = np.zeros(len(self.members), dtype=bool)
+            gone[free] = True
+            keep = ~(gone[self.ci] | gone[self.cj])
+            self.ci, self.cj = self.ci[keep], self.cj[keep]
+
+        # By the id the slot was given to, a recycled agent comes back under a new one
+        for slot, k in zip(slots.tolist(), born):
+            if slot < first:
+                del self.slots[self.ids[slot]]
+                self.members[slot] = agents[k]
+                self.ids[slot] = agents[k].id
+            else:
+                self.members.append(agents[k])
+                self.ids.append(agents[k].id)
+            self.slots[agents[k].id] = slot
+
+        grow = len(slots) - len(free)
+        self.anchor = np.concatenate([self.anchor, np.empty((grow, 2))])
+        self.alive = np.concatenate([self.alive, np.zeros(grow, dtype=bool)])
+        self.added = np.concatenate([self.added, np.zeros(grow, dtype=bool)])
+
+        # Living newborns of earlier frames since the rebuild, searched by their anchor instead of the index
+        later = np.flatnonzero(self.added & self.alive)
+        new_pos = pos[born]
+        self.anchor[slots] = new_pos
+        self.alive[slots] = True
+        self.added[slots] = True
+        reach = self.index.radius
+
+        found_i, found_j = [], []
+        for slot, point in zip(slots, new_pos):
+            # Against the agents in the index and those added since the last rebuild
+            j, _ = self.index.query(point)
+            j = j[~self.added[j]]
+            near = later[self.index.distance(self.anchor[later], point[None]) <= reach]
+            j = np.concatenate([j, near])
+            found_i += [np.full(len(j), slot), j]
+            found_j += [j, np.full(len(j), slot)]
+
+        # Newborns of this frame against each other, both directions come out of the square
+        d = self.index.delta(new_pos[:, None, :], new_pos[None, :, :])
+        a, b = np.nonzero((np.hypot(d[..., 0], d[..., 1]) <= reach) & ~np.eye(len(born), dtype=bool))
+        found_i.append(slots[a])
+        found_j.append(slots[b])
+
+        self.ci = np.concatenate([self.ci, *found_i]).astype(np.int64)
+        self.cj = np.concatenate([self.cj, *found_j]).astype(np.int64)
+        return slots
+
+
+class ProximityFrame:
+    """Neighbour lists of all agents for one frame, built lazily from a spatial index."""
+
+    def __init__(self, agents, width, height, radius, backend="grid", skin=0):
+        self.agents = agents
+        self.radius = radius
+        self.index = make_index(backend, width, height, radius + skin)
+        self.frame = None
+
+        # Neighbour counts of the frame in self.counted, for models that never need the neighbours themselves
+        self.counted = None
+        self.totals = np.zeros(0, dtype=np.int64)
+
+        # With a skin the pairs come from a Verlet list instead of a full rebuild every frame
+        self.verlet = VerletList(self.index, radius, skin) if skin > 0 else None
+
+        self.members = []
+        self.slots = {}
+
+    def _positions(self):
+        agents = self.agents.sprites()
+        return agents, positions(agents)
+
+    def update(self, frame):
+        self.frame = frame
+        agents, pos = self._positions()
+
+        if self.verlet is None:
+            self.members = agents
+            self.slots = {agent.id: slot for slot, agent in enumerate(self.members)}
+            self.index.rebuild(pos)
+            i, j, dist = self.index.pairs()
+        else:
+            i, j, dist = self.verlet.update(agents, pos)
+            self.members = self.verlet.members
+            self.slots = self.verlet.slots
+
+        # Group the pairs by the first agent so every agent's neighbours are one slice
+        order = np.argsort(i, kind="stable")
+        self.neighbour = j[order]
+        self.dist = dist[order]
+        self.offset = np.concatenate(([0], np.cumsum(np.bincount(i, minlength=len(self.members)))))
+
+        # Counts taken earlier in the frame follow the slots of these pairs from now on
+        if self.counted == frame:
+            self.totals = np.diff(self.offset)
+
+    def in_proximity(self, agent, frame):
+        # Generator of (agent, distance) like Agent.in_proximity_accuracy()
+        if frame != self.frame:
+            self.update(frame)
+
+        # Agents born during this frame are not in the index yet
+        slot = self.slots.get(agent.id)
+        if slot is None:
+            return
+
+        lo, hi = self.offset[slot], self.offset[slot + 1]
+        for j, dist in zip(self.neighbour[lo:hi].tolist(), self.dist[lo:hi].tolist()):
+            other = self.members[j]
+            if other.alive():
+                yield other, dist
+
+    def pairs(self, frame):
+        # Directed pairs (slot i, slot j) of self.members within the radius at the agents' current positions,
+        # for callers at the end of a frame after everyone moved. With a Verlet list that is just the distance
+        # check of its cached candidates, otherwise one rebuild of the index
+        self.update(frame)
+        i = np.repeat(np.arange(len(self.members)), np.diff(self.offset))
+        return i, self.neighbour
+
+    def counts(self, frame):
+        # Number of agents in proximity of every agent in self.members, in one call
+        if frame != self.counted:
+            self.count_all(frame)
+        return self.totals
+
+    def count_all(self, frame):
+        self.counted = frame
+
+        if self.verlet is not None or frame == self.frame:
+            # The pairs are there already (or kept by the Verlet list), counting them is a bincount
+            if frame != self.frame:
+                self.update(frame)
+            self.totals = np.diff(self.offset)
+            return
+
+        # Nobody asked for the neighbours themselves this frame, let the index count without building pairs
+        self.members, pos = self._positions()
+        self.slots = {agent.id: slot for slot, agent in enumerate(self.members)}
+        self.frame = None
+        self.index.rebuild(pos)
+        self.totals = self.index.counts(self.radius)
+
+    def count(self, agent, frame):
+        # Number of agents in proximity of one agent
+        counts = self.counts(frame)
+
+        slot = self.slots.get(agent.id)
+        if slot is None:
+            return 0
+        return int(counts[slot])
@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+
+from shared.spatial import DormantCounts, PreyIndex, VerletList, make_index
+
+
+WIDTH, HEIGHT, RADIUS = 200, 150, 15
+
+
+def brute_counts(pos, periodic):
+    d = pos[:, None, :] - pos[None, :, :]
+    if periodic:
+        size = np.array([WIDTH, HEIGHT], dtype=np.float64)
+        d -= size * np.round(d / size)
+    return (np.hypot(d[..., 0], d[..., 1]) <= RADIUS).sum(axis=1) - 1
+
+
+@pytest.mark.parametrize("periodic", [True, False])
+@pytest.mark.parametrize("max_stale", [0.25, 0.02])
+def test_dormant_counts_match_brute_force(periodic, max_stale):
+    # Agents freeze and wake at random, then the ones that aren't frozen take a small step,
+    # like the engine which counts at the start of the frame before anyone moves
+    rng = np.random.default_rng(3)
+    pos = rng.uniform(0, 1, (120, 2)) * [WIDTH, HEIGHT]
+    frozen = np.zeros(len(pos), dtype=bool)
+    dormant = DormantCounts(WIDTH, HEIGHT, RADIUS, periodic=periodic, max_stale=max_stale)
+
+    for _ in range(80):
+        frozen = np.where(rng.uniform(size=len(pos)) < 0.1, ~frozen, frozen)
+        assert (dormant.counts(pos, frozen) == brute_counts(pos, periodic)).all()
+
+        step = rng.normal(0, 2, pos.shape)
+        pos = np.where(frozen[:, None], pos, np.mod(pos + step, [WIDTH, HEIGHT]))
+
+    assert dormant.rebuilds > 1
+
+
+class Dot:
+    def __init__(self, id):
+        self.id = id
+
+
+@pytest.mark.parametrize("backend", ["grid", "kdtree"])
+def test_verlet_list_with_births_and_deaths_matches_a_rebuild_every_frame(backend):
+    # A few agents die and a few are born every frame, their slots get reused, everyone takes small steps
+    rng = np.random.default_rng(5)
+    agents = [Dot(k) for k in range(150)]
+    pos = rng.uniform(0, 1, (len(agents), 2)) * [WIDTH, HEIGHT]
+    verlet = VerletList(make_index(backend, WIDTH, HEIGHT, RADIUS + 6), RADIUS, 6)
+    fresh = make_index(backend, WIDTH, HEIGHT, RADIUS)
+    next_id = len(agents)
+    born = reused = 0
+
+    for _ in range(60):
+        slots, rebuilds = len(verlet.members), verlet.rebuilds
+        i, j, dist = verlet.update(agents, pos)
+        found = [(verlet.members[a].id, verlet.members[b].id) for a, b in zip(i.tolist(), j.tolist())]
+
+        fresh.rebuild(pos)
+        fi, fj, _ = fresh.pairs()
+        assert set(found) == {(agents[a].id, agents[b].id) for a, b in zip(fi.tolist(), fj.tolist())}
+
+        row = {agent.id: k for k, agent in enumerate(agents)}
+        a, b = np.array([[row[x], row[y]] for x, y in found], dtype=np.int64).reshape(-1, 2).T
+        assert np.allclose(dist, fresh.distance(pos[a], pos[b]))
+
+        # Newborns of this frame that got the slot of a dead agent
+        if verlet.rebuilds == rebuilds:
+            reused += sum(verlet.slots[agent.id] < slots for agent in agents if agent.id >= next_id - born)
+
+        alive = rng.uniform(size=len(agents)) > 0.03
+        agents = [agent for agent, keep in zip(agents, alive) if keep]
+        born = int(rng.integers(0, 6))
+        agents += [Dot(next_id + k) for k in range(born)]
+        pos = np.concatenate([pos[alive], rng.uniform(0, 1, (born, 2)) * [WIDTH, HEIGHT]])
+        pos = np.mod(pos + rng.normal(0, 0.4, pos.shape), [WIDTH, HEIGHT])
+        next_id += born
+
+    assert verlet.rebuilds < verlet.frames / 4
+    assert reused
+
+
+@pytest.mark.parametrize("k", [1, 8, 60])
+def test_prey_index_matches_unique_prey_within_the_radius(k):
+    rng = np.random.default_rng(7)
+    hunters = rng.uniform(0, 1, (40, 2)) * [WIDTH, HEIGHT]
+    prey = rng.uniform(0, 1, (60, 2)) * [WIDTH, HEIGHT]
+    index = PreyIndex(WIDTH, HEIGHT, RADIUS, k=k)
+    index.rebuild(prey)
+
+    rows, found, dist = index.match(hunters, rng)
+    assert len(rows) and len(np.unique(rows)) == len(rows) and len(np.unique(found)) == len(found)
+    assert np.allclose(dist, index.distance(hunters[rows], prey[found]))
+    assert (dist <= RADIUS).all()
+
+    # Looking at every prey, a hunter only goes without when everything within its reach was taken
+    if k >= len(prey):
+        taken = np.zeros(len(prey), dtype=bool)
+        taken[found] = True
+        for hunter in np.setdiff1d(np.arange(len(hunters)), rows):
+            near = index.distance(prey, hunters[hunter][None]) <= RADIUS
+            assert taken[near].all()